@@ -18,6 +18,14 @@ your application.
 
    views
    ext_renderer
+   bundles
+   keyset
+   datacache
+   serializers
+   queryplan
+   choices
+   live
+   delta
 
 """
 
@@ -65,6 +73,237 @@ class Plugin(Plugin):
     theme-classic is the default theme.
     """
 
+    site_cache_workers = None
+    """The number of worker processes to use for building the site cache.
+
+    The :xfile:`lino*.js` files for the different combinations of
+    user type and language are independent of each other and can be
+    rendered in parallel.  `None` or 1 means to build them one after
+    the other in the current process.  Parallel building requires the
+    ``fork`` start method, i.e. it is ignored on Windows.
+
+    """
+
+    site_cache_wait = True
+    """Whether a process which finds the site cache being built by
+    another process of the same site should wait until that build has
+    finished.
+
+    Only one process at a time builds the site cache (they synchronize
+    using a lock file in the :xfile:`media/cache/js` directory).  If
+    this is `False` and a previous version of the site cache exists,
+    the other processes don't wait but serve that previous version.
+
+    """
+
+    lazy_actor_chunks = False
+    """Whether to load the code generated for each actor only when it is
+    first used.
+
+    By default the :xfile:`lino*.js` file contains the GridPanel
+    class, the detail and insert panels and the window actions of
+    every actor visible to the user, and the browser loads all of it
+    before showing anything.  When this is `True`, the code of each
+    actor is written to a separate chunk file, and the
+    :xfile:`lino*.js` file contains only a manifest of these chunks
+    and stubs which load them (using :meth:`Ext.Loader.loadScript`)
+    the first time one of the actor's actions is run.
+
+    """
+
+    minify_site_cache = False
+    """Whether to also write a minified copy of every file of the site
+    cache, together with a source map.
+
+    The name of the minified copy contains a hash of its content, and
+    :xfile:`extjs/index.html` refers to it.  So these files never
+    change and the front-end server can serve them with
+    `Cache-Control: immutable`.  See
+    :mod:`lino_extjs6.extjs.bundles`.
+
+    """
+
+    precompress_site_cache = False
+    """Whether to write precompressed (:file:`.gz` and, if the
+    :mod:`brotli` module is installed, :file:`.br`) siblings of the
+    files of the site cache so that the front-end server can serve them
+    without compressing them for every request (e.g. using the
+    ``gzip_static`` and ``brotli_static`` directives of nginx).
+
+    """
+
+    max_printable_rows = 10000
+    """The maximum number of rows of a table to render as printable HTML.
+    `None` means no limit.
+
+    Printable HTML is streamed to the browser, so this is not needed
+    for the server's memory, but it protects against users who
+    accidentally print a table with millions of rows.
+
+    """
+
+    keyset_pagination = False
+    """Whether to use keyset pagination for the rows of a grid when
+    possible.  See :mod:`lino_extjs6.extjs.keyset`.
+
+    """
+
+    count_cache_timeout = None
+    """The number of seconds to cache the total row count of a grid.
+
+    The response to every page of rows contains the total number of
+    rows, and counting them can take longer than fetching the page.
+    When this is set, these counts are cached per actor, user and
+    query, and invalidated when one of the tables used by the query is
+    modified.  See :mod:`lino_extjs6.extjs.datacache`.  `None` means
+    to count every time.
+
+    """
+
+    approximate_count_threshold = None
+    """Above how many rows to use the approximate row count estimated by
+    the database instead of counting the rows.  `None` means to always
+    count.  Currently this works only on PostgreSQL.
+
+    """
+
+    columnar_json = False
+    """Whether grids should ask for their rows in columnar format.
+
+    In this format the server sends one list per column instead of
+    one list per row, and columns with few distinct values (e.g. the
+    text of a foreign key or a choicelist) are dictionary-encoded.
+    This makes the responses much smaller for wide grids.  See
+    :func:`lino_extjs6.extjs.views.rows2columns`.
+
+    """
+
+    column_projection = False
+    """Whether grids should fetch and serialize only their visible
+    columns.
+
+    The grid sends its visible columns with every request (otherwise
+    the default grid config is used).  Virtual fields of hidden
+    columns are not computed, and model fields of hidden columns as
+    well as unused text fields are deferred.  Showing a hidden column
+    reloads the grid.
+
+    Don't set this if some virtual field of your grids needs a model
+    field which is not visible, because that field would then be
+    loaded using one additional query per row.  See
+    :func:`lino_extjs6.extjs.queryplan.project_request`.
+
+    """
+
+    page_cache_actors = None
+    """A list of the names of the actors (e.g. ``'contacts.Persons'``)
+    whose JSON pages are to be cached in memory, or ``['*']`` for all
+    actors.
+
+    Pages are identified by user, language, parameter values, sort,
+    filters, start and limit, so a user never gets a page computed
+    for another user (rows contain e.g. the disabled fields and the
+    workflow buttons of that user).  Any modification of the database
+    invalidates all cached pages.  Use :meth:`page_cache.stats()
+    <lino_extjs6.extjs.datacache.PageCache.stats>` to see the number
+    of hits and misses.
+
+    """
+
+    page_cache_size = 1000
+    """The maximum number of pages in the page cache of each process.
+    See :attr:`page_cache_actors`.
+
+    """
+
+    batch_requests = False
+    """Whether the client should combine the requests for loading the
+    record and the slave grids of a detail window into a single
+    request.  See :class:`lino_extjs6.extjs.views.ApiBatch`.
+
+    """
+
+    batch_workers = None
+    """The number of threads to use for running the sub-requests of a
+    batch request in parallel.  `None` or 1 means to run them one after
+    the other.  Every thread uses its own database connection.
+
+    """
+
+    max_batch_size = 50
+    """The maximum number of sub-requests in a batch request."""
+
+    choices_cache_size = None
+    """The maximum number of choices responses to cache in each process.
+    `None` means to not cache them.  See
+    :mod:`lino_extjs6.extjs.choices` for the choosers which should not
+    use this.
+
+    """
+
+    indexed_choices_models = None
+    """A list of the names of models (e.g. ``'countries.Place'``) whose
+    choices don't change often and can be searched in memory.
+
+    Note that the in-memory search looks for the text of the choices
+    while the database search uses the :attr:`quick_search_fields
+    <lino.core.model.Model.quick_search_fields>` of the model.  This
+    is used only when :attr:`choices_cache_size` is set.
+
+    """
+
+    max_indexed_choices = 10000
+    """The maximum number of choices of a field to hold in an in-memory
+    index.  See :attr:`indexed_choices_models`.
+
+    """
+
+    combo_query_delay = 300
+    """The number of milliseconds a remote combobox waits after the last
+    keystroke before asking the server for matching choices.
+
+    """
+
+    combo_cache_size = 100
+    """The number of responses to the queries of remote comboboxes which
+    the browser keeps in memory.  Repeated queries (with the same
+    text and context) are answered from this cache.  0 means no cache.
+
+    """
+
+    combo_cache_timeout = 60
+    """The number of seconds after which the browser asks the server again
+    for a cached combobox query.  See :attr:`combo_cache_size`.
+
+    """
+
+    live_grids = False
+    """Whether the open grids should receive the changed rows from the
+    server and update them in place.  This requires
+    :attr:`use_websockets <lino.core.site.Site.use_websockets>` and
+    the routing described in :mod:`lino_extjs6.extjs.live`.
+
+    The saved rows are serialized by a channels worker, once for every
+    group of grids showing their table, so this doesn't slow down the
+    requests which save them.
+
+    """
+
+    delta_refresh = False
+    """Whether refreshing a grid should load only the rows which changed
+    since its last load.  This works for tables on models which have
+    a modification timestamp or whose changes are recorded.  See
+    :mod:`lino_extjs6.extjs.delta`.
+
+    """
+
+    max_delta_rows = 100
+    """The maximum number of changed rows to send for a delta refresh
+    when the request doesn't specify a limit.  When more rows have
+    changed, the client reloads the grid.
+
+    """
+
     def on_ui_init(self, kernel):
         # logger.info("20140227 extjs.Plugin.on_ui_init() a")
         from .ext_renderer import ExtRenderer
@@ -100,10 +339,13 @@ class Plugin(Plugin):
             # url(rx + r'auth$', views.Authenticate.as_view()),
             url(rx + r'grid_config/(?P<app_label>\w+)/(?P<actor>\w+)$',
                 views.GridConfig.as_view()),
+            url(rx + r'api/batch$', views.ApiBatch.as_view()),
             url(rx + r'api/(?P<app_label>\w+)/(?P<actor>\w+)$',
                 views.ApiList.as_view()),
             url(rx + r'api/(?P<app_label>\w+)/(?P<actor>\w+)/(?P<pk>.+)$',
                 views.ApiElement.as_view()),
+            url(rx + r'resequence/(?P<app_label>\w+)/(?P<actor>\w+)$',
+                views.Resequence.as_view()),
             url(rx + r'restful/(?P<app_label>\w+)/(?P<actor>\w+)$',
                 views.Restful.as_view()),
             url(rx + r'restful/(?P<app_label>\w+)/(?P<actor>\w+)/(?P<pk>.+)$',
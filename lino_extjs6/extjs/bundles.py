@@ -0,0 +1,150 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Utilities for publishing the files of the site cache: minifying
+them (with a source map) and writing precompressed siblings.
+
+The minifier is deliberately simple: it removes comment lines, blank
+lines and indentation but never touches the content of a line and
+never joins lines.  So it cannot change the meaning of the code
+(e.g. by automatic semicolon insertion), and every line of the
+minified code comes from exactly one line of the original.
+
+"""
+
+from __future__ import unicode_literals
+
+import os
+import gzip
+import json
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+VLQ_CHARS = (
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/')
+
+
+def vlq_encode(value):
+    """Encode the given integer as a Base64 VLQ as used in source maps."""
+    if value < 0:
+        value = ((-value) << 1) | 1
+    else:
+        value <<= 1
+    s = ''
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value:
+            digit |= 32
+        s += VLQ_CHARS[digit]
+        if not value:
+            return s
+
+
+def minify_js(code):
+    """Minify the given Javascript code.
+
+    Return a tuple `(minified, origins)` where `origins` has, for
+    every line of `minified`, a tuple `(line, column)` with the
+    position in `code` where it comes from (both zero-based).
+
+    """
+    lines = []
+    origins = []
+    in_comment = False
+    continued = False  # whether the previous line ends a string with "\"
+    for i, ln in enumerate(code.splitlines()):
+        if continued:
+            # leading whitespace is part of the string
+            lines.append(ln)
+            origins.append((i, 0))
+            continued = ln.endswith('\\')
+            continue
+        s = ln.strip()
+        col = len(ln) - len(ln.lstrip())
+        if in_comment:
+            j = s.find('*/')
+            if j == -1:
+                continue
+            in_comment = False
+            col += j + 2
+            s = s[j + 2:]
+            col += len(s) - len(s.lstrip())
+            s = s.strip()
+        if not s or s.startswith('//'):
+            continue
+        if s.startswith('/*'):
+            j = s.find('*/', 2)
+            if j == -1:
+                in_comment = True
+                continue
+            if not s[j + 2:].strip():
+                continue
+        lines.append(s)
+        origins.append((i, col))
+        continued = s.endswith('\\')
+    return '\n'.join(lines) + '\n', origins
+
+
+def make_source_map(filename, source, origins):
+    """Return the JSON text of a source map for a file `filename` which
+    has been produced from a file `source` by :func:`minify_js`.
+
+    """
+    segments = []
+    prev_line = prev_col = 0
+    for line, col in origins:
+        # generated column 0, source 0, original line, original column
+        segments.append(
+            'AA' + vlq_encode(line - prev_line) + vlq_encode(col - prev_col))
+        prev_line, prev_col = line, col
+    return json.dumps(dict(
+        version=3, file=filename, sources=[source], names=[],
+        mappings=';'.join(segments)))
+
+
+def write_atomic(fn, data):
+    """Write the given bytes to the given file name.  The file is replaced
+    atomically.
+
+    """
+    tmp = "%s.%d.tmp" % (fn, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    getattr(os, 'replace', os.rename)(tmp, fn)
+
+
+def precompress(fn):
+    """Write a gzip compressed copy of the given file with suffix
+    :file:`.gz` and (if the :mod:`brotli` module is installed) a brotli
+    compressed copy with suffix :file:`.br`.
+
+    """
+    with open(fn, 'rb') as f:
+        data = f.read()
+    tmp = "%s.gz.%d.tmp" % (fn, os.getpid())
+    # mtime=0 makes the output depend only on the content
+    with open(tmp, 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw,
+                           compresslevel=9, mtime=0) as f:
+            f.write(data)
+    getattr(os, 'replace', os.rename)(tmp, fn + '.gz')
+    if brotli is not None:
+        write_atomic(fn + '.br', brotli.compress(data))
+
+
+def remove_variants(fn):
+    """Remove the given file together with its source map, its pointer to
+    its minified copy and its precompressed siblings, as far as they
+    exist.
+
+    """
+    for suffix in ('', '.min', '.map', '.gz', '.br'):
+        try:
+            os.remove(fn + suffix)
+        except OSError:
+            pass
@@ -0,0 +1,203 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Caching the responses of the :class:`Choices
+<lino_extjs6.extjs.views.Choices>` and :class:`ActionParamChoices
+<lino_extjs6.extjs.views.ActionParamChoices>` views, which are called
+for every keystroke in a remote combobox.
+
+When :attr:`choices_cache_size
+<lino_extjs6.extjs.Plugin.choices_cache_size>` is set, the responses
+are kept in the :data:`choices_cache` of each process.  They are
+invalidated when one of the tables used by the query of the choices,
+or one of the tables of the models it points to through a foreign key
+(whose rows are often used by the text of a choice), is modified (see
+:mod:`lino_extjs6.extjs.datacache`).  This covers only
+:data:`TEXT_DEPTH` levels of foreign keys.  Don't use the cache for
+choosers whose texts depend on other rows, e.g. on reverse relations
+or on a custom :meth:`__str__` which runs its own queries.
+
+The choices for models listed in :attr:`indexed_choices_models
+<lino_extjs6.extjs.Plugin.indexed_choices_models>` are moreover
+searched using a :class:`ChoicesIndex`, an in-memory trigram index of
+all choices, so that typing into the combobox doesn't cause any
+database query as long as the table is not modified.
+
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+from builtins import str
+from collections import defaultdict
+
+from django import http
+from django.conf import settings
+from django.db import models
+from django.utils import translation
+from django.core.exceptions import EmptyResultSet
+
+from lino.core import constants
+from lino.core.views import json_response_kw
+from lino.modlib.extjs.views import choices_response
+
+from .datacache import PageCache, get_tables
+
+choices_cache = PageCache('choices_cache_size')
+"""The cache of choices responses and indexes of this process."""
+
+TEXT_DEPTH = 2
+"""How many levels of foreign keys are followed by
+:func:`get_text_tables`."""
+
+
+def trigrams(text):
+    """Return the set of trigrams of the given (lowercased) text."""
+    return set([text[i:i + 3] for i in range(len(text) - 2)])
+
+
+class ChoicesIndex(object):
+    """An in-memory index of the given choices (a list of dicts as returned
+    by `row2dict`) for answering quick searches.
+
+    A choice matches when the search text is contained in its text
+    (case-insensitive).  Choices are returned in their original order.
+
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.texts = [
+            str(r[constants.CHOICES_TEXT_FIELD]).lower() for r in rows]
+        self.index = defaultdict(set)
+        for i, text in enumerate(self.texts):
+            for tg in trigrams(text):
+                self.index[tg].add(i)
+
+    def search(self, text):
+        """Return the list of choices which match the given search text."""
+        if not text:
+            return list(self.rows)
+        text = text.lower()
+        if len(text) < 3:
+            candidates = range(len(self.rows))
+        else:
+            sets = [self.index.get(tg, set()) for tg in trigrams(text)]
+            sets.sort(key=len)
+            candidates = sorted(set.intersection(*sets))
+        return [self.rows[i] for i in candidates if text in self.texts[i]]
+
+
+def get_text_tables(model, depth=TEXT_DEPTH):
+    """Return the set of the tables of the models to which the given model
+    points through a concrete foreign key, following at most `depth`
+    levels.
+
+    """
+    tables = set()
+    todo = [model]
+    for i in range(depth):
+        found = []
+        for m in todo:
+            for fld in m._meta.concrete_fields:
+                if fld.is_relation and fld.related_model is not None:
+                    rm = fld.related_model
+                    if rm._meta.db_table not in tables:
+                        tables.add(rm._meta.db_table)
+                        found.append(rm)
+        todo = found
+    return tables
+
+
+def get_choices_key(holder, request, qs, exclude=('_dc',)):
+    """Return a tuple `(key, tables)` where `key` identifies the choices
+    response for the given queryset and request (holder, URL, user
+    type, language, URL parameters and SQL) and `tables` are the tables it
+    depends on (see :func:`get_text_tables`).  Return `(None, None)` if the queryset is empty
+    anyway.
+
+    """
+    try:
+        sql, params = qs.query.sql_with_params()
+    except EmptyResultSet:
+        return None, None
+    user_type = getattr(request.user, 'user_type', None)
+    items = sorted([(k, request.GET.getlist(k)) for k in request.GET.keys()
+                    if k not in exclude])
+    data = repr((str(holder), request.path,
+                 getattr(user_type, 'value', None),
+                 translation.get_language(), items, sql, params))
+    key = hashlib.sha1(data.encode('utf-8')).hexdigest()
+    tables = set(get_tables(qs)) | get_text_tables(qs.model)
+    return key, sorted(tables)
+
+
+def get_index(holder, request, qs, row2dict):
+    """Return the :class:`ChoicesIndex` for the given queryset, or `None`
+    if it has more than :attr:`max_indexed_choices
+    <lino_extjs6.extjs.Plugin.max_indexed_choices>` rows.
+
+    """
+    key, tables = get_choices_key(
+        holder, request, qs, ('_dc', constants.URL_PARAM_FILTER,
+                              constants.URL_PARAM_START,
+                              constants.URL_PARAM_LIMIT))
+    if key is None:
+        return ChoicesIndex([])
+    key = 'index.' + key
+    index = choices_cache.get(key, tables)
+    if index is None:
+        limit = settings.SITE.plugins.extjs.max_indexed_choices
+        rows = [row2dict(row, {}) for row in qs[:limit + 1]]
+        if len(rows) > limit:
+            index = False  # remember that it is too big
+        else:
+            index = ChoicesIndex(rows)
+        choices_cache.set(key, index, tables)
+    return index or None
+
+
+def is_indexed(model):
+    names = settings.SITE.plugins.extjs.indexed_choices_models
+    return bool(names) and model._meta.label in names
+
+
+def cached_choices_response(actor, holder, request, qs, row2dict,
+                            emptyValue):
+    """Same as :func:`choices_response
+    <lino.modlib.extjs.views.choices_response>`, but uses the
+    :data:`choices_cache`.  `holder` is the object whose choices are
+    requested (an actor or an action).
+
+    """
+    if not settings.SITE.plugins.extjs.choices_cache_size \
+       or not isinstance(qs, models.QuerySet):
+        return choices_response(actor, request, qs, row2dict, emptyValue)
+
+    if is_indexed(qs.model):
+        index = get_index(holder, request, qs, row2dict)
+        if index is not None:
+            quick_search = request.GET.get(constants.URL_PARAM_FILTER, None)
+            offset = request.GET.get(constants.URL_PARAM_START, None)
+            limit = request.GET.get(constants.URL_PARAM_LIMIT, None)
+            rows = index.search(quick_search)
+            count = len(rows)
+            rows = rows[int(offset):] if offset else rows
+            rows = rows[:int(limit)] if limit else rows
+            if emptyValue is not None and not quick_search:
+                empty = dict()
+                empty[constants.CHOICES_TEXT_FIELD] = emptyValue
+                empty[constants.CHOICES_VALUE_FIELD] = None
+                rows.insert(0, empty)
+            return json_response_kw(count=count, rows=rows)
+
+    key, tables = get_choices_key(holder, request, qs)
+    if key is None:
+        return choices_response(actor, request, qs, row2dict, emptyValue)
+    content = choices_cache.get(key, tables)
+    if content is None:
+        response = choices_response(actor, request, qs, row2dict, emptyValue)
+        choices_cache.set(key, response.content, tables)
+        return response
+    return http.HttpResponse(content, content_type='application/json')
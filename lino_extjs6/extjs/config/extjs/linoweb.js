@@ -308,42 +308,50 @@ Ext.define('Ext.grid.ViewDropZone', {
             data.view.store.remove(data.records);
         }
         if (record && position) {
-
             /*
-            * Need to switch the data of the two records.
-            * Send an Ajax PUT request to update the selected row
-            * Update the sorting INT for all rows
-            *
-            * Might be better to just save the row with the requested position.
+            * Ask the server to move the dropped row to the position of
+            * the target row (see views.Resequence), then apply the
+            * changed sequence numbers to the rows of this page.
             */
-
-            index = store.indexOf(record); // original
+            var grid = view.grid;
+            var field = grid.viewConfig.plugins.sequenced_field;
             var r = data.records[0];
-            var c = {
-                grid: view.grid,
-                record: r,
-                field: view.grid.viewConfig.plugins.sequenced_field,
-                originalValue: r.data.seqno,
-                value: r.data.seqno,
-                cancel: false
-            };
-            // 'after', or undefined (meaning a drop at index -1 on an empty View)...
-            r.data[c.field]= record.data[c.field];
-            if (position !== 'before') { // orginal
-                index++;
-                r.data[c.field]++; // new
-            }
-            c.value = r.data[c.field];
-            view.grid.on_beforeedit(null, c);
-            if (!c.cancel){
-                r.modified = {};
-                r.modified[c.field] =  c.originalValue;
-                view.grid.store.on('load', view.grid.ensureVisibleRecord, view.grid,
-                              {row:index}
-                               /*,column:status.focus.column}*/);
-                view.grid.on_afteredit(null,c);
-
+            var old = r.data[field];
+            var target = record.data[field];
+            if (position === 'before') {
+                if (old !== null && old < target) target--;
+            } else if (old === null || old > target) {
+                target++;
             }
+            index = store.indexOf(record);
+            if (position !== 'before') index++;
+            var p = {pk: r.getId(), target: target};
+            Lino.insert_subst_user(p);
+            Ext.Ajax.request({
+                method: 'POST',
+                url: '{{extjs.build_plain_url("resequence")}}' + grid.ls_url,
+                params: p,
+                failure: Lino.ajax_error_handler(grid),
+                success: function(response) {
+                    var result = Ext.decode(response.responseText);
+                    if (!result.success) return;
+                    Ext.each(result.changed, function(c) {
+                        var rec = store.getById(c[0]);
+                        if (rec) {
+                            rec.set(field, c[1]);
+                            rec.commit();
+                        }
+                    });
+                    if (store.isBufferedStore) {
+                        // a BufferedStore cannot move rows
+                        store.reload();
+                    } else if (store.indexOf(r) >= 0) {
+                        if (store.indexOf(r) < index) index--;
+                        store.remove(r);
+                        store.insert(index, r);
+                    }
+                }
+            });
 
 //            store.insert(index, data.records); // original
         } else // No position specified - append.
@@ -972,9 +980,113 @@ Ext.define('Lino.WindowAction', {
       var panel = Ext.getCmp(requesting_panel);
         if(panel) panel.do_when_clean(true, f); else f();
     }
-  
+
 });
 
+/*
+Loading actor chunks on demand (when `lazy_actor_chunks` is set).
+The lino*.js file defines `Lino.chunks` (which maps actor names to
+the url of their chunk and the actors whose GridPanel classes it
+needs) and a stub for every window action and custom action.
+*/
+Lino.chunks = {};
+
+Lino.resolve_name = function(name) {
+    var obj = Lino;
+    Ext.each(name.split('.'), function(part) {
+        if (obj) obj = obj[part];
+    });
+    return obj;
+};
+
+Lino.load_chunk_script = function(actor, callback) {
+    var chunk = Lino.chunks[actor];
+    if (!chunk || chunk.loaded) {
+        callback();
+        return;
+    }
+    if (chunk.waiting) {  // already being loaded
+        chunk.waiting.push(callback);
+        return;
+    }
+    chunk.waiting = [callback];
+    Ext.Loader.loadScript({
+        url: chunk.url,
+        onLoad: function() {
+            var waiting = chunk.waiting;
+            chunk.loaded = true;
+            delete chunk.waiting;
+            Ext.each(waiting, function(fn) { fn(); });
+        },
+        onError: function() {
+            delete chunk.waiting;
+            Lino.alert("Could not load " + chunk.url);
+        }
+    });
+};
+
+Lino.load_chunk = function(actor, callback, scope) {
+    // Load the chunk of the given actor and those it requires. Their
+    // own requirements are not needed because they are loaded when
+    // one of their stubs gets called.
+    var chunk = Lino.chunks[actor];
+    var names = chunk ? chunk.requires.concat([actor]) : [];
+    var pending = names.length;
+    if (pending == 0) {
+        callback.call(scope);
+        return;
+    }
+    Ext.each(names, function(name) {
+        Lino.load_chunk_script(name, function() {
+            pending -= 1;
+            if (pending == 0) callback.call(scope);
+        });
+    });
+};
+
+Lino.lazy_window_action = function(actor, name) {
+    var stub = {
+        lazy_name : name,
+        run : function(requesting_panel, status) {
+            Lino.load_chunk(actor, function() {
+                var wa = Lino.resolve_name(name);
+                if (wa === stub)
+                    console.log("Chunk", actor, "does not define", name);
+                else
+                    wa.run(requesting_panel, status);
+            });
+        }
+    };
+    return stub;
+};
+
+Lino.resolve_handler = function(h) {
+    // Return the window action which replaced the given stub once its
+    // chunk has been loaded, or the given handler itself.
+    if (h && h.lazy_name) return Lino.resolve_name(h.lazy_name) || h;
+    return h;
+};
+
+Lino.same_handler = function(a, b) {
+    // Whether the given window actions are the same, even if one of
+    // them is a stub created by Lino.lazy_window_action.
+    return Lino.resolve_handler(a) === Lino.resolve_handler(b);
+};
+
+Lino.lazy_function = function(actor, name) {
+    var stub = function() {
+        var scope = this, args = arguments;
+        Lino.load_chunk(actor, function() {
+            var fn = Lino.resolve_name(name);
+            if (fn === stub)
+                console.log("Chunk", actor, "does not define", name);
+            else
+                fn.apply(scope, args);
+        });
+    };
+    return stub;
+};
+
 // HKC
 //Lino.PanelMixin = {
 Ext.define('Lino.PanelMixin', {
@@ -1575,7 +1687,7 @@ Lino.handle_action_result = function (panel, result, on_success, on_confirm) {
         if(result.record_id || result.data_record) {
             var ww = Lino.calling_window();
             if (ww && ww.window.main_item instanceof Lino.FormPanel) {
-                if (ww.window.main_item.ls_detail_handler == detail_handler) {
+                if (Lino.same_handler(ww.window.main_item.ls_detail_handler, detail_handler)) {
                     ns.record_id = result.record_id;
                     ns.data_record = result.data_record;
                     // console.log("20150514 use new status.");
@@ -1603,7 +1715,7 @@ Lino.handle_action_result = function (panel, result, on_success, on_confirm) {
           };
           if (result.active_tab) st.active_tab = result.active_tab;
           if (panel instanceof Lino.FormPanel 
-              && panel.ls_detail_handler == detail_handler) 
+              && Lino.same_handler(panel.ls_detail_handler, detail_handler))
             {
               // console.log("20150514 use panel.set_status().");
               panel.set_status(st);
@@ -1670,7 +1782,8 @@ Lino.handle_action_result = function (panel, result, on_success, on_confirm) {
         }
     }
 
-    if(result.record_deleted && panel.ls_detail_handler == detail_handler) {
+    if(result.record_deleted
+       && Lino.same_handler(panel.ls_detail_handler, detail_handler)) {
         panel.after_delete();
     }
     
@@ -2132,6 +2245,12 @@ Lino.call_ajax_action = function(
       };
       p.{{constants.URL_PARAM_SELECTED}} = rs;
   }
+  if (actionName == 'delete_selected' && panel.ls_url
+      && Ext.isArray(p.{{constants.URL_PARAM_SELECTED}})
+      && p.{{constants.URL_PARAM_SELECTED}}.length > 1) {
+      Lino.delete_selected_rows(panel, p.{{constants.URL_PARAM_SELECTED}});
+      return;
+  }
   
   // console.log("20140516 Lino.call_ajax_action", p, actionName, step);
   if (panel.loadMask) panel.loadMask.show();
@@ -2148,6 +2267,43 @@ Lino.call_ajax_action = function(
 
 
 
+/*
+ * Delete the given rows of the given grid using a single request (see
+ * views.ApiList.delete) instead of one request per row.
+ */
+Lino.delete_selected_rows = function(panel, pks) {
+  var msg = Ext.String.format(
+      "{{_('Are you sure you want to delete {0} rows?')}}", pks.length);
+  Ext.Msg.confirm("{{_('Confirmation')}}", msg, function(btn) {
+      if (btn != 'yes') return;
+      var p = {};
+      p.{{constants.URL_PARAM_SELECTED}} = pks;
+      Lino.insert_subst_user(p);
+      if (panel.loadMask) panel.loadMask.show();
+      Ext.Ajax.request({
+          method: 'DELETE'
+          ,url: '{{extjs.build_plain_url("api")}}' + panel.ls_url
+          ,params: p
+          ,failure: Lino.ajax_error_handler(panel)
+          ,success: function(response) {
+              if (panel.loadMask) panel.loadMask.hide();
+              var result = Ext.decode(response.responseText);
+              if (result.failures && result.failures.length) {
+                  var lines = [result.message];
+                  Ext.each(result.failures, function(f) {
+                      lines.push(f.message);
+                  });
+                  Ext.Msg.alert("{{_('Problem')}}", lines.join('<br/>'));
+              } else {
+                  Lino.notify(result.message);
+              }
+              panel.refresh();
+          }
+      });
+  });
+};
+
+
 Lino.row_action_handler = function(actionName, hm, pp) {
   var p = {};
   var fn = function(panel, btn, step) {
@@ -3192,11 +3348,13 @@ Ext.define('Lino.FormPanel', {
     p.{{constants.URL_PARAM_FORMAT}} = '{{constants.URL_FORMAT_JSON}}';
     this.add_param_values(p);
     if (this.loadMask) this.loadMask.show();
-    Ext.Ajax.request({
+    {% if extjs.batch_requests %}Lino.batch_request{% else %}Ext.Ajax.request{% endif %}({
       waitMsg: 'Loading record...',
       method: 'GET',
       params: p,
       scope: this,
+      // see noCache of the GridPanel proxy
+      disableCaching: false,
       url: this.get_record_url(record_id),
       success: function(response) {
         // todo: convert to Lino.action_handler.... but result
@@ -3659,6 +3817,7 @@ Lino.getRowClass = function(record, rowIndex, rowParams, store) {
     //~ console.log(20130816,record);
     //~ return 'x-grid3-row-green';
     //~ return record.data.row_class + ' auto-height';
+    if (record.lino_deleted) return 'lino-deleted-row';  // see Lino.live_rows
     return record.data.row_class;
   //~ if (true) {
       //~ return 'x-grid3-row-red';
@@ -3674,6 +3833,113 @@ Lino.getRowClass = function(record, rowIndex, rowParams, store) {
 
 //~ FOO = 0;
 
+{% if extjs.batch_requests %}
+Lino.batch_queue = [];
+
+Lino.batch_request = function(config) {
+    // Same as Ext.Ajax.request(config), but GET requests issued during
+    // the same event (e.g. the slave grids of a detail window) are sent
+    // together in a single request to api/batch.  Returns an object
+    // which can be given to Ext.Ajax.abort().
+    if (config.method && config.method.toUpperCase() != 'GET') {
+        return Ext.Ajax.request(config);
+    }
+    var raw = {
+        loading: true,
+        isLoading: function() { return this.loading; },
+        abort: function() { this.loading = false; }
+    };
+    Lino.batch_queue.push({config: config, raw: raw});
+    if (Lino.batch_queue.length == 1) Ext.defer(Lino.send_batch, 1);
+    return raw;
+};
+
+Lino.send_batch = function() {
+    var pending = [];
+    Ext.each(Lino.batch_queue, function(q) {
+        if (q.raw.loading) pending.push(q);
+    });
+    Lino.batch_queue = [];
+    if (pending.length == 0) return;
+    if (pending.length == 1) {
+        var q = pending[0];
+        var r = Ext.Ajax.request(q.config);
+        q.raw.abort = function() { this.loading = false; Ext.Ajax.abort(r); };
+        return;
+    }
+    var specs = [];
+    Ext.each(pending, function(q) {
+        specs.push({url: q.config.url, params: q.config.params || {}});
+    });
+    Ext.Ajax.request({
+        method: 'POST',
+        url: '{{extjs.build_plain_url("api", "batch")}}',
+        params: {requests: Ext.encode(specs)},
+        callback: function(options, success, response) {
+            var result = success ? Ext.decode(response.responseText) : null;
+            Ext.each(pending, function(q, i) {
+                if (!q.raw.loading) return;  // aborted meanwhile
+                q.raw.loading = false;
+                var r = result ? result.responses[i] :
+                    {status: response.status, text: response.responseText};
+                var sub = {
+                    status: r.status,
+                    responseText: r.text,
+                    request: {options: q.config},
+                    getResponseHeader: function() { return null; },
+                    getAllResponseHeaders: function() { return {}; }
+                };
+                var ok = (r.status >= 200 && r.status < 300);
+                Ext.callback(ok ? q.config.success : q.config.failure,
+                             q.config.scope, [sub, q.config]);
+                Ext.callback(q.config.callback, q.config.scope,
+                             [q.config, ok, sub]);
+            });
+        }
+    });
+};
+
+Ext.define('Lino.BatchProxy', {
+    // An ajax proxy whose read requests go through Lino.batch_request
+    extend: 'Ext.data.proxy.Ajax'
+    ,alias: 'proxy.linobatch'
+    ,sendRequest: function(request) {
+        request.setRawRequest(Lino.batch_request(request.getCurrentConfig()));
+        this.lastRequest = request;
+        return request;
+    }
+});
+{% endif %}
+
+Lino.decode_columns = function(columns, nrows) {
+    // Convert a list of columns (some of them dictionary-encoded) as
+    // returned by the server into a list of rows.
+    var rows = [], i;
+    for (i = 0; i < nrows; i++) rows.push(new Array(columns.length));
+    Ext.each(columns, function(col, j) {
+        if (Ext.isArray(col)) {
+            for (i = 0; i < nrows; i++) rows[i][j] = col[i];
+        } else {
+            for (i = 0; i < nrows; i++) rows[i][j] = col.d[col.i[i]];
+        }
+    });
+    return rows;
+};
+
+Ext.define('Lino.ColumnarJsonReader', {
+    // A json reader which also understands the columnar format
+    // (requested by the `columnar` parameter).
+    extend: 'Ext.data.reader.Json'
+    ,alias: 'reader.linojson'
+    ,readRecords: function(data, readOptions, internalReadOptions) {
+        if (data && data.columns) {
+            data.rows = Lino.decode_columns(data.columns, data.nrows);
+            delete data.columns;
+        }
+        return this.callParent([data, readOptions, internalReadOptions]);
+    }
+});
+
 //Edited by HKC
 //Lino.GridStore = Ext.extend(Ext.data.ArrayStore,{
 Lino.GridStoreConfig = {
@@ -3691,9 +3957,37 @@ Lino.GridStoreConfig = {
         // options.params['idParam'] = this.idParam;
         // options.params['id'] = this.idParam;
         this.grid_panel.add_param_values(options.params);
+        {% if extjs.columnar_json %}
+        options.params.columnar = 1;  // see Lino.ColumnarJsonReader
+        {% endif %}
+        {% if extjs.column_projection %}
+        // tell the server which columns are visible
+        if (this.grid_panel.rendered) {
+            var gc = this.grid_panel.get_current_grid_config();
+            options.params.{{constants.URL_PARAM_COLUMNS}} = gc.{{constants.URL_PARAM_COLUMNS}};
+            options.params.{{constants.URL_PARAM_HIDDENS}} = gc.{{constants.URL_PARAM_HIDDENS}};
+        }
+        {% endif %}
+        // keyset pagination: send the cursor of the previous page if we
+        // know it. The server ignores it if it doesn't match.
+        if (!options.start) {
+            this.keyset_cursors = {};
+        } else if (this.keyset_cursors && this.keyset_cursors[options.start]) {
+            options.params.cursor = this.keyset_cursors[options.start];
+        }
         return options;
     }
 
+    ,remember_cursor: function(store, records, successful) {
+        // called after loading a page
+        if (!successful) return;
+        var raw = store.getProxy().getReader().rawData;
+        if (raw && raw.next_cursor) {
+            if (!store.keyset_cursors) store.keyset_cursors = {};
+            store.keyset_cursors[raw.next_cursor.start] = raw.next_cursor.value;
+        }
+    }
+
     // TFP OLD CODE,
     //  , load: function(options){
     //~ foo.bar = baz; // 20120213
@@ -3779,6 +4073,151 @@ Ext.define('Lino.GridJsonStore', Ext.apply(Lino.GridStoreConfig,{
 }));
 
 
+{% if (extjs.live_grids and site.use_websockets) or extjs.delta_refresh %}
+Lino.read_row_records = function(store, rows) {
+    var reader = store.getProxy().getReader();
+    var raw = reader.rawData;  // used by the load listeners
+    var records = reader.read({rows: rows, count: rows.length}).getRecords();
+    reader.rawData = raw;
+    return records;
+};
+
+/*
+ * Patch the given changed rows into the given grid store.  `delta`
+ * may have `updated` (rows to update if loaded), `created` (rows to
+ * update or insert) and `deleted` (primary keys of rows to remove).
+ * Returns the number of changes which could not be applied because a
+ * BufferedStore can neither insert nor remove rows.
+ */
+Lino.apply_row_deltas = function(store, delta) {
+    var buffered = store.isBufferedStore;
+    var missed = 0;
+    var changed = false;
+    var update = function(old, rec) {
+        if (!old.dirty) {  // don't overwrite what the user types
+            old.set(rec.getData());
+            old.commit();
+        }
+    };
+    Ext.each(Lino.read_row_records(store, delta.updated || []), function(rec) {
+        var old = store.getById(rec.getId());
+        if (old) update(old, rec);
+    });
+    Ext.each(Lino.read_row_records(store, delta.created || []), function(rec) {
+        var old = store.getById(rec.getId());
+        if (old) {
+            update(old, rec);
+        } else if (buffered) {
+            missed++;
+        } else {
+            store.insert(0, rec);
+            store.totalCount++;
+        }
+    });
+    Ext.each(delta.deleted || [], function(pk) {
+        var old = store.getById(pk);
+        if (!old) return;
+        if (buffered) {
+            old.lino_deleted = true;  // see Lino.getRowClass
+            changed = true;
+            missed++;
+        } else {
+            store.remove(old, true);  // not a deletion to be synced
+            store.totalCount--;
+        }
+    });
+    if (changed) store.grid_panel.getView().refresh();
+    return missed;
+};
+{% endif %}
+
+{% if extjs.live_grids and site.use_websockets %}
+/*
+ * Live grids: receive the rows which have been changed on the server
+ * and patch them into the stores of the open grids.  See
+ * lino_extjs6.extjs.live.
+ */
+Lino.live_rows = {
+    bridge: null
+    ,is_open: false
+    ,grids: {}   // grid id -> {grid, params, key, group}
+    ,groups: {}  // group -> array of grid ids
+
+    ,connect: function() {
+        if (this.bridge) return;
+        var self = this;
+        this.bridge = new channels.WebSocketBridge();
+        this.bridge.connect('/extjs/rows/');
+        this.bridge.listen(function(msg) { self.on_message(msg); });
+        this.bridge.socket.addEventListener('open', function() {
+            // the server forgets our groups when the socket is closed
+            self.is_open = true;
+            self.groups = {};
+            Ext.Object.each(self.grids, function(id) {
+                self.send_subscribe(id);
+            });
+        });
+        this.bridge.socket.addEventListener('close', function() {
+            self.is_open = false;
+        });
+    }
+
+    ,subscribe: function(grid) {
+        // called after every load of the grid's store
+        var p = grid.get_base_params();
+        grid.add_param_values(p);
+        var key = Ext.encode(p);
+        var entry = this.grids[grid.getId()];
+        if (entry && entry.key === key) return;
+        this.unsubscribe(grid);
+        if (!entry) grid.on('destroy', this.unsubscribe, this);
+        this.grids[grid.getId()] = {grid: grid, params: p, key: key};
+        this.connect();
+        if (this.is_open) this.send_subscribe(grid.getId());
+    }
+
+    ,send_subscribe: function(id) {
+        var entry = this.grids[id];
+        this.bridge.send({
+            subscribe: id,
+            actor: entry.grid.ls_url.substr(1),
+            params: entry.params,
+            language: '{{language}}'
+        });
+    }
+
+    ,unsubscribe: function(grid) {
+        var id = grid.getId();
+        var entry = this.grids[id];
+        if (!entry) return;
+        delete this.grids[id];
+        var ids = entry.group && this.groups[entry.group];
+        if (!ids) return;
+        Ext.Array.remove(ids, id);
+        if (ids.length === 0) {
+            delete this.groups[entry.group];
+            if (this.is_open) this.bridge.send({unsubscribe: entry.group});
+        }
+    }
+
+    ,on_message: function(msg) {
+        if (msg.type === 'subscribed') {
+            var entry = this.grids[msg.id];
+            if (!entry) return;
+            entry.group = msg.group;
+            if (!this.groups[msg.group]) this.groups[msg.group] = [];
+            Ext.Array.include(this.groups[msg.group], msg.id);
+        } else if (msg.type === 'rows') {
+            var self = this;
+            Ext.each(this.groups[msg.group] || [], function(id) {
+                var entry = self.grids[id];
+                if (entry) Lino.apply_row_deltas(entry.grid.getStore(), msg);
+            });
+        }
+    }
+};
+{% endif %}
+
 Lino.get_current_grid_config = function(panel) {
     return panel.get_current_grid_config();
 }
@@ -3907,15 +4346,19 @@ Ext.define('Lino.GridPanel', {
     /* e.g. when slave gridwindow called from a permalink */
     //~ if (this.base_params) Ext.apply(bp,this.base_params);  
     
-    var proxy = Ext.create('Ext.data.HttpProxy',{
+    var proxy = Ext.create({% if extjs.batch_requests %}'Lino.BatchProxy'{% else %}'Ext.data.HttpProxy'{% endif %},{
 
     //var proxy = {
       // 20120814 
       url: '{{extjs.build_plain_url("api")}}' + this.ls_url
       ,method: "GET"
+      // no `_dc` parameter so that the browser can revalidate its
+      // cached copy using the ETag (the server answers 304 when the
+      // page hasn't changed)
+      ,noCache: false
       ,idParam : this.ls_id_property
       ,reader: {
-          type: 'json',
+          type: 'linojson',
           rootProperty: 'rows',
           totalProperty: "count", 
           idProperty: this.ls_id_property,
@@ -3964,6 +4407,27 @@ Ext.define('Lino.GridPanel', {
     * Prevents Ajax race conditions. Ticket #2136
     *
     **/
+    this.store.on('prefetch', this.store.remember_cursor);
+    this.store.on('load', this.store.remember_cursor);
+    {% if extjs.delta_refresh %}
+    this.store.on('beforeload', function(store) { store.since_token = null; });
+    var remember_token = function(store, records, successful) {
+        if (!successful) return;
+        var raw = store.getProxy().getReader().rawData;
+        if (!raw || !raw.since_token) return;
+        // keep the oldest token of all pages in the buffer
+        if (!store.since_token || raw.since_token < store.since_token)
+            store.since_token = raw.since_token;
+        store.since_key = this_.get_delta_key();
+    };
+    this.store.on('prefetch', remember_token);
+    this.store.on('load', remember_token);
+    {% endif %}
+    {% if extjs.live_grids and site.use_websockets %}
+    this.store.on('load', function(store, records, successful) {
+        if (successful) Lino.live_rows.subscribe(this_);
+    });
+    {% endif %}
     this.store._storeOperations = []
     this.store.on('beforeload', function(theStore, operation, eOpts) {
                         var lastOperation = theStore._storeOperations.pop();
@@ -4159,6 +4623,10 @@ Ext.define('Lino.GridPanel', {
       
     this.on('celldblclick' , this.on_celldblclick , this);
     this.on('cellkeydown' , this.on_cellkeydown , this);
+    {% if extjs.column_projection %}
+    // hidden columns have not been loaded (see setup_options)
+    this.on('columnshow', function() { this.store.reload(); }, this);
+    {% endif %}
 
     //~ this.on('contextmenu', Lino.grid_context_menu, this);
       // Lino.GridPanel.superclass.initComponent.call(this);
@@ -4249,8 +4717,53 @@ Ext.define('Lino.GridPanel', {
   },
   
   refresh : function(unused) { 
+    {% if extjs.delta_refresh %}
+    if (this.refresh_delta()) return;
+    {% endif %}
     this.refresh_with_after();
   },
+  {% if extjs.delta_refresh %}
+  /* GridPanel */
+  get_delta_key : function() {
+    // identifies the parameters which select the rows of this grid
+    var p = this.get_base_params();
+    this.add_param_values(p);
+    return Ext.encode(p);
+  },
+  /* GridPanel */
+  refresh_delta : function() {
+    // Load only the rows which changed since the last load (see
+    // lino_extjs6.extjs.delta). Return false if a full reload is needed.
+    var store = this.store;
+    if (!this.view_is_ready || !store.since_token) return false;
+    if (this.containing_panel)
+        this.set_base_params(this.containing_panel.get_master_params());
+    if (this.get_delta_key() !== store.since_key) return false;
+    var p = this.get_base_params();
+    this.add_param_values(p);
+    p.{{constants.URL_PARAM_FORMAT}} = '{{constants.URL_FORMAT_JSON}}';
+    p.{{constants.URL_PARAM_LIMIT}} = store.pageSize;
+    p.since = store.since_token;
+    var panel = this;
+    Ext.Ajax.request({
+        method: 'GET',
+        url: '{{extjs.build_plain_url("api")}}' + this.ls_url,
+        params: p,
+        failure: Lino.ajax_error_handler(this),
+        success: function(response) {
+            var result = Ext.decode(response.responseText);
+            if (!result.delta || Lino.apply_row_deltas(store, {
+                    created: result.rows, deleted: result.deleted})) {
+                panel.refresh_with_after();
+                return;
+            }
+            store.since_token = result.since_token;
+            if (!store.isBufferedStore) store.totalCount = result.count;
+        }
+    });
+    return true;
+  },
+  {% endif %}
   /* GridPanel */
   refresh_with_after : function(after) { 
     // console.log('20140504 Lino.GridPanel.refresh '+ this.store.proxy.url);
@@ -5452,6 +5965,80 @@ Ext.define('Lino.ChoicesFieldElement',{
         return ret;
     },
 });
+Lino.combo_cache = {
+    // An LRU cache of the responses to the queries of remote combo
+    // boxes, keyed by url and parameters (including the contextParams).
+    size: {{extjs.combo_cache_size or 0}},
+    timeout: {{extjs.combo_cache_timeout or 0}} * 1000,
+    keys: [],
+    entries: {},
+    get: function(key) {
+        var entry = this.entries[key];
+        if (entry === undefined) return undefined;
+        this.keys.splice(this.keys.indexOf(key), 1);
+        if (this.timeout && new Date().getTime() - entry.time > this.timeout) {
+            delete this.entries[key];
+            return undefined;
+        }
+        this.keys.push(key);  // now the most recently used
+        return entry.data;
+    },
+    set: function(key, data) {
+        if (!this.size) return;
+        if (this.entries[key] !== undefined)
+            this.keys.splice(this.keys.indexOf(key), 1);
+        this.entries[key] = {data: data, time: new Date().getTime()};
+        this.keys.push(key);
+        while (this.keys.length > this.size)
+            delete this.entries[this.keys.shift()];
+    },
+    clear: function() {
+        this.keys = [];
+        this.entries = {};
+    }
+};
+
+Lino.load_combo_store = function(store, options) {
+    // Called by the load() method of the remote combo stores. Answer
+    // from Lino.combo_cache if possible and return true, otherwise
+    // prepare options so that the response gets cached and return
+    // false.
+    var proxy = store.getProxy();
+    if (!Lino.combo_cache.size || !proxy || !proxy.url) return false;
+    var p = Ext.apply({}, options.params, proxy.getExtraParams());
+    if (options.start !== undefined) p.{{constants.URL_PARAM_START}} = options.start;
+    if (options.limit !== undefined) p.{{constants.URL_PARAM_LIMIT}} = options.limit;
+    var key = proxy.url + '?' + Ext.Object.toQueryString(p);
+    var data = Lino.combo_cache.get(key);
+    if (data !== undefined) {
+        if (store.lastOperation && store.lastOperation.isRunning())
+            store.lastOperation.abort();
+        store.loadRawData(data);
+        Ext.callback(options.callback, options.scope || store,
+                     [store.getRange(), null, true]);
+        return true;
+    }
+    var callback = options.callback;
+    options.callback = function(records, operation, success) {
+        var raw = proxy.getReader().rawData;
+        if (success && raw) Lino.combo_cache.set(key, raw);
+        Ext.callback(callback, options.scope || store,
+                     [records, operation, success]);
+    };
+    return false;
+};
+
+Lino.abort_previous_load = function(store, operation) {
+    // beforeload handler of the remote combo stores: cancel the
+    // previous request so that its response cannot overwrite the
+    // response to this one.
+    var previous = store.lastOperation;
+    if (previous && previous !== operation && previous.isRunning())
+        previous.abort();
+    store.lastOperation = operation;
+    return true;
+};
+
 Ext.define('Lino.SimpleRemoteComboStore',{
   extend:'Ext.data.JsonStore',
 //Lino.SimpleRemoteComboStore = Ext.extend(Ext.data.JsonStore,{
@@ -5462,7 +6049,10 @@ Ext.define('Lino.SimpleRemoteComboStore',{
           root: 'rows',
           id: '{{constants.CHOICES_VALUE_FIELD}}', // 'value'
           fields: ['{{constants.CHOICES_VALUE_FIELD}}' ],
-          listeners: { exception: Lino.on_store_exception }
+          listeners: {
+              exception: Lino.on_store_exception,
+              beforeload: Lino.abort_previous_load
+          }
       }));
       //this.callSuper(Ext.apply(config, {
       //    totalProperty: 'count',
@@ -5472,6 +6062,11 @@ Ext.define('Lino.SimpleRemoteComboStore',{
       //    listeners: { exception: Lino.on_store_exception }
       //}));
   }
+  ,load: function(options) {
+      options = options || {};
+      if (Lino.load_combo_store(this, options)) return this;
+      return this.callParent([options]);
+  }
 });
 
 Ext.define('Lino.ComplexRemoteComboStore',{
@@ -5483,7 +6078,10 @@ Ext.define('Lino.ComplexRemoteComboStore',{
           root: 'rows',
           id: 'value', // constants.CHOICES_VALUE_FIELD
           fields: ['value','text'], // constants.CHOICES_VALUE_FIELD, // constants.CHOICES_TEXT_FIELD
-          listeners: { exception: Lino.on_store_exception }
+          listeners: {
+              exception: Lino.on_store_exception,
+              beforeload: Lino.abort_previous_load
+          }
       }));
       //this.callSuper(Ext.apply(config, {
       //    totalProperty: 'count',
@@ -5493,6 +6091,11 @@ Ext.define('Lino.ComplexRemoteComboStore',{
       //    listeners: { exception: Lino.on_store_exception }
       //}));
   }
+  ,load: function(options) {
+      options = options || {};
+      if (Lino.load_combo_store(this, options)) return this;
+      return this.callParent([options]);
+  }
 });
 
 Ext.define('Lino.RemoteComboFieldElement',{
@@ -5502,7 +6105,7 @@ Ext.define('Lino.RemoteComboFieldElement',{
   width:235,
   //~ forceSelection:false,
   minChars: 2, // default 4 is too much
-  queryDelay: 300, // default 500 is maybe slow
+  queryDelay: {{extjs.combo_query_delay}}, // default 500 is maybe slow
   queryParam: '{{constants.URL_PARAM_FILTER}}', 
   //~ typeAhead: true,
   //~ selectOnFocus: true, // select any existing text in the field immediately on focus.
@@ -0,0 +1,277 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Caching data which is expensive to compute for every request, using
+the Django cache framework.
+
+Cached values are invalidated using a *generation* counter per
+database table, which is incremented whenever a row of that table is
+saved or deleted (see :mod:`lino_extjs6.extjs.models`).  The
+generations of all tables used by a query are part of the cache key,
+so a cached value is never used after one of these tables has been
+modified.  Note that bulk operations like :meth:`QuerySet.update`
+don't send signals and therefore don't invalidate anything, the
+timeout of the cached values is the limit in that case.
+
+In a site with several processes, this works only when the cache
+backend is shared between them (e.g. memcached or redis).
+
+The :data:`page_cache` is different: it holds the JSON responses of
+:class:`ApiList <lino_extjs6.extjs.views.ApiList>` in the memory of
+each process, and all of them are invalidated by any modification.
+
+"""
+
+from __future__ import unicode_literals
+
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import models, connections
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.utils import translation
+
+GENERATION_KEY = 'lino_extjs6.gen.%s'
+COUNT_KEY = 'lino_extjs6.count.%s'
+ALL_TABLES = '*'
+
+
+def uses_generations():
+    """Whether one of the caches which depend on the generations is
+    enabled: the count cache, the :data:`page_cache` or the choices
+    cache.  Otherwise there is no need to maintain them.
+
+    """
+    plugin = settings.SITE.plugins.extjs
+    return plugin.count_cache_timeout is not None \
+        or bool(plugin.page_cache_actors and plugin.page_cache_size) \
+        or bool(plugin.choices_cache_size)
+
+
+def bump_generation(model):
+    """Invalidate all cached values which depend on the table of the given
+    model.  Does nothing when :func:`uses_generations` is false.
+
+    """
+    if not uses_generations():
+        return
+    for t in (model._meta.db_table, ALL_TABLES):
+        key = GENERATION_KEY % t
+        try:
+            cache.incr(key)
+        except ValueError:  # not yet in the cache
+            cache.add(key, 1, None)
+    page_cache.clear()
+
+
+def get_tables(qs):
+    """Return a sorted list of the names of the tables used by the given
+    queryset.  Must be called after its SQL has been generated because
+    only then the query knows all its tables.
+
+    """
+    tables = set([qs.model._meta.db_table])
+    for join in qs.query.alias_map.values():
+        tables.add(join.table_name)
+    return sorted(tables)
+
+
+def get_generations(tables):
+    """Return a list with the current generation of the given tables."""
+    keys = [GENERATION_KEY % t for t in tables]
+    gens = cache.get_many(keys)
+    return [gens.get(k, 0) for k in keys]
+
+
+def get_query_key(ar, qs):
+    """Return a string which identifies the given queryset of the given
+    table request, including the user and the generations of the
+    tables it uses.  Return `None` if the queryset is empty anyway.
+
+    """
+    try:
+        sql, params = qs.query.sql_with_params()
+    except EmptyResultSet:
+        return None
+    user = ar.get_user()
+    data = repr((str(ar.actor), getattr(user, 'pk', None), sql, params,
+                 get_generations(get_tables(qs))))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def estimate_count(qs):
+    """Return the number of rows of the given queryset as estimated by the
+    query planner, or `None` if the database cannot estimate it.  This
+    is currently implemented only for PostgreSQL.
+
+    """
+    connection = connections[qs.db]
+    if connection.vendor != 'postgresql':
+        return None
+    try:
+        sql, params = qs.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN " + sql, params)
+        plan = cursor.fetchone()[0]
+    mo = re.search(r'rows=(\d+)', plan)
+    if mo is None:
+        return None
+    return int(mo.group(1))
+
+
+def get_total_count(ar):
+    """Return the total number of rows of the given table request.
+
+    Same as :meth:`get_total_count
+    <lino.core.tablerequest.TableRequest.get_total_count>`, but uses
+    :attr:`count_cache_timeout
+    <lino_extjs6.extjs.Plugin.count_cache_timeout>` and
+    :attr:`approximate_count_threshold
+    <lino_extjs6.extjs.Plugin.approximate_count_threshold>`.
+
+    """
+    plugin = settings.SITE.plugins.extjs
+    qs = ar.data_iterator
+    if not isinstance(qs, models.QuerySet):
+        return ar.get_total_count()
+    timeout = plugin.count_cache_timeout
+    threshold = plugin.approximate_count_threshold
+    if timeout is None and threshold is None:
+        return ar.get_total_count()
+
+    key = None
+    if timeout is not None:
+        key = get_query_key(ar, qs)
+        if key is None:
+            return 0
+        key = COUNT_KEY % key
+        n = cache.get(key)
+        if n is not None:
+            return n
+
+    n = None
+    if threshold is not None:
+        n = estimate_count(qs)
+        if n is not None and n <= threshold:
+            n = None  # small enough to count exactly
+    if n is None:
+        n = ar.get_total_count()
+    if key is not None:
+        cache.set(key, n, timeout)
+    return n
+
+
+class PageCache(object):
+    """A size-limited cache of responses with least-recently-used
+    eviction.
+
+    Every entry remembers the generations of the tables it depends on
+    (by default :data:`ALL_TABLES`) at the moment it was stored and is
+    considered invalid when one of these generations has changed,
+    i.e. when a row of one of these tables has been saved or deleted
+    in any process since then.
+
+    `size_option` is the name of the plugin attribute which specifies
+    the maximum number of entries.
+
+    .. attribute:: hits
+    .. attribute:: misses
+
+        The number of successful and failed lookups since the start of
+        the process.
+
+    """
+
+    def __init__(self, size_option='page_cache_size'):
+        self.size_option = size_option
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_max_size(self):
+        return getattr(settings.SITE.plugins.extjs, self.size_option)
+
+    def is_enabled(self, actor):
+        """Whether pages of the given actor are to be cached."""
+        actors = settings.SITE.plugins.extjs.page_cache_actors
+        if not actors or not self.get_max_size():
+            return False
+        return '*' in actors or str(actor) in actors
+
+    def get(self, key, tables=(ALL_TABLES,)):
+        """Return the value stored under the given key or `None`."""
+        gens = get_generations(tables)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] != gens:
+                self.misses += 1
+                return None
+            self.entries[key] = entry  # now the most recently used
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, tables=(ALL_TABLES,)):
+        gens = get_generations(tables)
+        max_size = self.get_max_size()
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (gens, value)
+            while len(self.entries) > max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Return a dict with the hit and miss counts, the hit ratio and the
+        current number of entries.
+
+        """
+        total = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses,
+                    ratio=float(self.hits) / total if total else None,
+                    size=len(self.entries))
+
+
+page_cache = PageCache()
+"""The :class:`PageCache` of this process."""
+
+
+def get_page_key(ar, qs, exclude=('_dc',), extra=None):
+    """Return a string which identifies the JSON response for the given
+    table request: its actor, user, language, URL parameters
+    (parameter values, sort, filters, start, limit, ...), the SQL of
+    its queryset and the given `extra` value (anything else the
+    response contains).  Return `None` if the queryset is empty
+    anyway.
+
+    The rows of a response may depend on the user (disabled fields,
+    workflow buttons, virtual fields), so pages are never shared
+    between users, not even between users of the same user type.
+
+    """
+    sql = params = None
+    if isinstance(qs, models.QuerySet):
+        try:
+            sql, params = qs.query.sql_with_params()
+        except EmptyResultSet:
+            return None
+    user = ar.get_user()
+    rqdata = ar.rqdata
+    items = []
+    if rqdata is not None:
+        items = sorted([(k, rqdata.getlist(k)) for k in rqdata.keys()
+                        if k not in exclude])
+    data = repr((str(ar.actor), getattr(user, 'pk', None),
+                 getattr(ar, 'subst_user', None) is not None,
+                 translation.get_language(), items, sql, params, extra))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
@@ -0,0 +1,151 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Refreshing a grid by loading only the rows which changed since its
+last load (see :attr:`delta_refresh
+<lino_extjs6.extjs.Plugin.delta_refresh>`).
+
+Every JSON response of :class:`ApiList
+<lino_extjs6.extjs.views.ApiList>` for a supported model contains a
+`since_token`.  When the client sends this token back as
+:data:`URL_PARAM_SINCE`, the response contains only the rows which
+have been created or modified since then (`rows`) and the primary keys
+of the rows which have been deleted or which no longer belong to the
+grid (`deleted`).
+
+A model is supported when it has a :class:`DateTimeField` named
+``modified`` (e.g. because it inherits from :class:`Modified
+<lino.mixins.Modified>`) or when its changes are recorded by
+:mod:`lino.modlib.changes`.  Deleted rows are known only from the
+change log.
+
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.utils import timezone
+
+from lino.api import rt
+
+URL_PARAM_SINCE = 'since'
+
+TOKEN_FORMAT = '%Y%m%d%H%M%S%f'
+
+TOKEN_MARGIN = datetime.timedelta(seconds=10)
+"""How much older a token is than the response which contains it.  Rows
+which are saved by a transaction that started before the token but
+was committed after it are sent again by the next delta refresh,
+rows modified during this margin as well."""
+
+
+def get_timestamp_field(model):
+    """Return the name of the modification timestamp of the given model
+    or `None`.
+
+    """
+    try:
+        fld = model._meta.get_field('modified')
+    except FieldDoesNotExist:
+        return None
+    if isinstance(fld, models.DateTimeField):
+        return fld.name
+    return None
+
+
+def has_change_log(model):
+    return settings.SITE.is_installed('changes') and \
+        getattr(model, 'change_watcher_spec', None) is not None
+
+
+def is_supported(model):
+    """Whether delta refresh is possible for rows of the given model."""
+    return get_timestamp_field(model) is not None or has_change_log(model)
+
+
+TOKEN_STEP = 10
+"""The number of seconds during which the same token is returned.
+Tokens are rounded down to this step so that successive responses
+with unchanged rows have the same content (and thus the same ETag,
+see :func:`conditional_response
+<lino_extjs6.extjs.views.conditional_response>`)."""
+
+
+def get_token():
+    """Return a new token for the current time."""
+    t = timezone.now() - TOKEN_MARGIN
+    t -= datetime.timedelta(
+        seconds=t.second % TOKEN_STEP, microseconds=t.microsecond)
+    return t.strftime(TOKEN_FORMAT)
+
+
+def parse_token(token):
+    """Return the time of the given token or `None` if it is invalid."""
+    try:
+        t = datetime.datetime.strptime(token, TOKEN_FORMAT)
+    except (TypeError, ValueError):
+        return None
+    if settings.USE_TZ:
+        t = timezone.make_aware(t, timezone.utc)
+    return t
+
+
+def get_changes(model, since):
+    """Return a tuple `(changed, deleted)` with the primary keys of the
+    rows of the given model which have been created or modified
+    resp. deleted since the given time according to the change log.
+
+    """
+    Change = rt.models.changes.Change
+    ChangeTypes = rt.models.changes.ChangeTypes
+    qs = Change.objects.filter(
+        object_type=rt.models.contenttypes.ContentType.objects.get_for_model(
+            model), time__gt=since)
+    changed = set()
+    deleted = set()
+    for pk, ct in qs.values_list('object_id', 'type'):
+        if ct == ChangeTypes.delete:
+            deleted.add(pk)
+        else:
+            changed.add(pk)
+    return changed - deleted, deleted
+
+
+def get_delta(ar, since, limit):
+    """Return a tuple `(rows, deleted)` where `rows` are the rows of the
+    given table request which have been created or modified since the
+    given time, and `deleted` the primary keys of rows which have been
+    deleted or no longer belong to the table request.  Return `(None,
+    None)` if more than `limit` rows changed (the client should rather
+    reload).
+
+    """
+    qs = ar.data_iterator
+    model = qs.model
+    fld = get_timestamp_field(model)
+    deleted = set()
+    if fld is not None:
+        changed = qs.filter(**{fld + '__gt': since})
+        gone = model.objects.filter(**{fld + '__gt': since}).exclude(
+            pk__in=qs.values('pk'))
+        deleted.update(gone.values_list('pk', flat=True)[:limit + 1])
+        if has_change_log(model):
+            deleted.update(get_changes(model, since)[1])
+    else:
+        pks, deleted = get_changes(model, since)
+        if len(pks) > limit:
+            return None, None
+        changed = qs.filter(pk__in=pks)
+    rows = list(changed[:limit + 1])
+    if len(rows) + len(deleted) > limit:
+        return None, None
+    found = set([row.pk for row in rows])
+    if fld is None:
+        deleted.update(pks - found)  # no longer in the table request
+    deleted -= found
+    return rows, sorted(deleted)
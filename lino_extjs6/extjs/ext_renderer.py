@@ -13,8 +13,22 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+import os
+import re
+import codecs
+import shutil
+import time
+import hashlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # e.g. on Windows
+    fcntl = None
 
 from django.conf import settings
+from django.utils.html import escape
+from django.utils import translation
 
 from django.utils.translation import ugettext as _
 
@@ -23,18 +37,91 @@ from lino.core.gfks import ContentType
 import lino
 from lino.core import constants
 
+from lino.api.ad import Plugin
 
 from lino.core.actions import ShowDetail, ShowInsert, ShowTable
 from lino.core import dbtables
+from lino.core import tables
+from lino.core import choicelists
 
 from lino.utils import jsgen
 from lino.utils.jsgen import py2js, js_code
 
-from lino.modlib.users.utils import get_user_profile
+from lino.modlib.users.utils import get_user_profile, with_user_profile
+from lino.modlib.users.choicelists import UserTypes
 
 from lino.modlib.extjs import ext_renderer
 from lino.core import elems as ext_elems
 
+from .bundles import minify_js, make_source_map, write_atomic, precompress
+from .bundles import remove_variants
+
+ACTOR_BEGIN = "// begin actor %s"
+ACTOR_END = "// end actor %s"
+"""Comment lines which delimit the code generated for a given actor
+in a :xfile:`lino*.js` file.  :meth:`ExtRenderer.rebuild_actor_js`
+uses them to find the fragment to rewrite.
+
+"""
+
+
+SITE_CACHE_HASH_FILE = 'lino_js.sha1'
+"""The name of the file (in the same directory as the :xfile:`lino*.js`
+files) where :meth:`ExtRenderer.build_site_cache` stores the hash of
+the inputs used for building them.
+
+"""
+
+
+SITE_CACHE_LOCK_FILE = 'lino_js.lock'
+"""The name of the lock file used to make sure that only one process at
+a time builds the site cache.
+
+"""
+
+
+GRID_PANEL_REF = re.compile(r"Lino\.(\w+\.\w+)\.GridPanel\b")
+"""Matches references to the GridPanel class of an actor in generated
+code.
+
+"""
+
+CLASS_REF = re.compile(r"Lino\.([\w\.]+)")
+
+
+def find_class_refs(code, names):
+    """Return the set of the given class names (e.g.
+    ``contacts.Persons.DetailFormPanel``) which are used by the given
+    generated code.
+
+    """
+    found = set()
+    for ref in set(CLASS_REF.findall(code)):
+        parts = ref.split('.')
+        for i in range(1, len(parts) + 1):
+            name = '.'.join(parts[:i])
+            if name in names:
+                found.add(name)
+    return found
+
+
+def build_js_cache_job(job):
+    """Build one :xfile:`lino*.js` file in a worker process.  `job` is a
+    tuple `(language, user_type_value, force)`.  Must be a module-level
+    function because it is pickled by :mod:`multiprocessing`.
+
+    """
+    return settings.SITE.kernel.extjs_renderer.build_js_cache_for(*job)
+
+
+def replace_file(src, dst):
+    """Rename `src` to `dst`, replacing `dst` if it exists.  This is
+    atomic on POSIX systems, so a concurrent reader sees either the old
+    or the new file, never a half-written one.
+
+    """
+    getattr(os, 'replace', os.rename)(src, dst)
+
 
 
 class ExtRenderer(ext_renderer.ExtRenderer):
@@ -43,7 +130,910 @@ class ExtRenderer(ext_renderer.ExtRenderer):
     """
 
     extjs_version = 6
-    
+
+    linoweb_names = None
+    """A dict which maps each language to the name of its
+    :xfile:`linoweb.js` file.  See :meth:`linoweb_js_parts`.
+
+    """
+
+    site_cache_current = False
+    """Whether the hash of the site cache inputs was unchanged when
+    :meth:`build_site_cache` ran.  When this is `True`,
+    :meth:`build_js_cache` doesn't rebuild existing files.
+
+    """
+
+    def build_site_cache(self, force=False):
+        """Build the site cache files under `/media/cache`, especially the
+        :xfile:`lino*.js` files, one per user type and language.
+
+        Same as in ExtJS 3 except that the :xfile:`lino*.js` files are
+        built in parallel when :attr:`site_cache_workers
+        <lino_extjs6.extjs.Plugin.site_cache_workers>` is set, and that
+        only one process at a time builds them.  Other processes of the
+        same site wait for that build or (if :attr:`site_cache_wait
+        <lino_extjs6.extjs.Plugin.site_cache_wait>` is `False`) serve
+        the previous version.
+
+        """
+        if settings.SITE.never_build_site_cache:
+            logger.debug(
+                "Not building site cache because "
+                "`settings.SITE.never_build_site_cache` is True")
+            return
+        if not os.path.isdir(settings.MEDIA_ROOT):
+            logger.debug(
+                "Not building site cache because " +
+                "directory '%s' (settings.MEDIA_ROOT) does not exist.",
+                settings.MEDIA_ROOT)
+            return
+
+        started = time.time()
+
+        settings.SITE.on_each_app('setup_site_cache', force)
+
+        settings.SITE.makedirs_if_missing(
+            os.path.join(settings.MEDIA_ROOT, 'upload'))
+        settings.SITE.makedirs_if_missing(
+            os.path.join(settings.MEDIA_ROOT, 'webdav'))
+
+        # other processes serve the previous version (if there is one)
+        # or wait until we are done
+        wait = self.plugin.site_cache_wait or \
+            self.read_site_cache_hash() is None
+        with self.lock_site_cache(wait) as locked:
+            if not locked:
+                logger.info("Another process is building the site cache. "
+                            "Using the previous version.")
+                self.site_cache_current = True
+                return
+            self.build_site_cache_locked(force, started)
+
+    def build_site_cache_locked(self, force, started):
+        """The part of :meth:`build_site_cache` which runs while we hold the
+        lock on the site cache directory.
+
+        """
+        digest = self.get_site_cache_hash()
+        self.site_cache_current = (
+            not force and digest == self.read_site_cache_hash())
+        if self.site_cache_current:
+            logger.info("Site cache %s is up to date.", digest[:12])
+
+        if force or settings.SITE.build_js_cache_on_startup:
+            for lng in settings.SITE.languages:
+                with translation.override(lng.django_code):
+                    self.linoweb_js_parts()
+            # when the inputs have changed, existing files are obsolete
+            # even if they are newer than the code
+            jobs = [
+                (lng.django_code, user_type.value,
+                 not self.site_cache_current)
+                for lng in settings.SITE.languages
+                for user_type in UserTypes.objects()]
+            workers = self.plugin.site_cache_workers or 1
+            results = None
+            if workers > 1 and len(jobs) > 1:
+                results = self.run_parallel_jobs(jobs, workers)
+            if results is None:
+                workers = 1
+                results = [self.build_js_cache_for(*job) for job in jobs]
+            count = sum([r[0] for r in results])
+            elapsed = time.time() - started
+            logger.info("%d lino*.js files have been built in %s seconds.",
+                        count, elapsed)
+            if workers > 1:
+                logger.info(
+                    "%d worker processes saved %s seconds "
+                    "(%s seconds when built serially).",
+                    workers, sum([r[1] for r in results]) - elapsed,
+                    sum([r[1] for r in results]))
+        elif not self.site_cache_current:
+            self.clear_js_cache()
+
+        self.write_site_cache_hash(digest)
+        self.site_cache_current = True
+
+    def build_js_cache(self, force):
+        """Build the :xfile:`lino*.js` file for the current user type and
+        language.
+
+        Same as in ExtJS 3 except that an existing file is considered
+        up to date (even when the kernel asks for a rebuild) if the
+        hash of the site cache inputs has not changed since it was
+        built, and that the file is replaced atomically.  A file which
+        is older than the code is always rebuilt.
+
+        """
+        fn = os.path.join(settings.MEDIA_ROOT, *self.lino_js_parts())
+        if not force and os.path.exists(fn):
+            kernel = settings.SITE.kernel
+            if os.stat(fn).st_mtime > kernel.code_mtime:
+                if self.site_cache_current:
+                    return 0
+                if not getattr(kernel, '_must_build', False):
+                    return 0
+        self.write_cache_file(fn, self.write_lino_js)
+        return 1
+
+    def write_cache_file(self, fn, write):
+        """Call `write` with a file object and atomically move the written
+        file to `fn`.
+
+        A :xfile:`lino*.js` file is never written in place because a
+        browser might request it while it is being written.
+
+        """
+        logger.debug("Building %s ...", fn)
+        settings.SITE.makedirs_if_missing(os.path.dirname(fn))
+        tmp = "%s.%d.tmp" % (fn, os.getpid())
+        f = codecs.open(tmp, 'w', encoding='utf-8')
+        try:
+            write(f)
+            f.close()
+        except Exception:
+            f.close()
+            if not settings.SITE.keep_erroneous_cache_files:
+                os.remove(tmp)
+            raise
+        replace_file(tmp, fn)
+        self.publish_cache_file(fn)
+
+    def publish_cache_file(self, fn):
+        """Write the published variants of the given cache file.
+
+        When :attr:`minify_site_cache
+        <lino_extjs6.extjs.Plugin.minify_site_cache>` is set, write a
+        minified copy (with a source map) whose name contains a hash
+        of its content.  Such a file never changes, so it can be
+        served with `Cache-Control: immutable`.  The name of the
+        minified copy is stored in a file with suffix :file:`.min`
+        next to the original (see :meth:`get_published_name`).
+
+        When :attr:`precompress_site_cache
+        <lino_extjs6.extjs.Plugin.precompress_site_cache>` is set, write
+        :file:`.gz` and :file:`.br` siblings of the published file.
+
+        The minified copy which was published before is kept (for
+        browsers which still have a page referring to it) until the
+        next one is published.  Its name is the second line of the
+        :file:`.min` file.
+
+        """
+        pub = fn
+        if self.plugin.minify_site_cache:
+            with codecs.open(fn, 'r', encoding='utf-8') as f:
+                minified, origins = minify_js(f.read())
+            name = '%s.%s.min.js' % (
+                os.path.basename(fn)[:-3],
+                hashlib.sha1(minified.encode('utf-8')).hexdigest()[:12])
+            pub = os.path.join(os.path.dirname(fn), name)
+            if not os.path.exists(pub):
+                minified += "//# sourceMappingURL=%s.map\n" % name
+                write_atomic(pub + '.map', make_source_map(
+                    name, os.path.basename(fn), origins).encode('utf-8'))
+                write_atomic(pub, minified.encode('utf-8'))
+            names = self.get_published_names(fn)
+            if names[:1] != [name]:
+                # keep the current one, remove the previous one
+                for old in names[1:]:
+                    if old != name:
+                        remove_variants(
+                            os.path.join(os.path.dirname(fn), old))
+                names = [name] + names[:1]
+                write_atomic(fn + '.min', '\n'.join(names).encode('utf-8'))
+        if self.plugin.precompress_site_cache:
+            if pub == fn or not os.path.exists(pub + '.gz'):
+                precompress(pub)
+
+    def get_published_name(self, fn):
+        """Return the name (without directory) of the file to serve for the
+        given cache file.
+
+        """
+        if self.plugin.minify_site_cache:
+            names = self.get_published_names(fn)
+            if names:
+                return names[0]
+        return os.path.basename(fn)
+
+    def get_published_names(self, fn):
+        """Return the names of the current and previous minified copies of
+        the given cache file, as far as they are known.
+
+        """
+        if not os.path.exists(fn + '.min'):
+            return []
+        with open(fn + '.min') as f:
+            return f.read().split()
+
+    def remove_cache_file(self, fn):
+        """Remove the given cache file together with its published
+        variants.
+
+        """
+        for name in self.get_published_names(fn):
+            remove_variants(os.path.join(os.path.dirname(fn), name))
+        remove_variants(fn)
+
+    def is_published(self, fn):
+        """Whether the given cache file exists and its published variants
+        are up to date with the current settings.
+
+        """
+        if not os.path.exists(fn):
+            return False
+        pub = os.path.join(os.path.dirname(fn), self.get_published_name(fn))
+        if self.plugin.minify_site_cache and pub == fn:
+            return False
+        if self.plugin.precompress_site_cache and \
+           not os.path.exists(pub + '.gz'):
+            return False
+        return True
+
+    def published_parts(self, parts):
+        """Convert the given parts of the url of a cache file (as returned
+        e.g. by :meth:`lino_js_parts`) into those of the file to serve.
+        Called from :xfile:`extjs/index.html`.
+
+        """
+        fn = os.path.join(settings.MEDIA_ROOT, *parts)
+        return parts[:-1] + (self.get_published_name(fn),)
+
+    @contextmanager
+    def lock_site_cache(self, wait=True):
+        """Context manager which holds an exclusive lock on the site cache
+        directory, shared by all processes of this site.  Yields
+        `True` when the lock has been acquired.  When `wait` is
+        `False` and another process holds the lock, yields `False`
+        immediately.
+
+        Without :mod:`fcntl` (e.g. on Windows) there is no locking.
+
+        """
+        if fcntl is None:
+            yield True
+            return
+        dn = self.get_js_cache_dir()
+        settings.SITE.makedirs_if_missing(dn)
+        f = open(os.path.join(dn, SITE_CACHE_LOCK_FILE), 'a')
+        try:
+            flags = fcntl.LOCK_EX
+            if not wait:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(f, flags)
+                locked = True
+            except (IOError, OSError):
+                locked = False
+            try:
+                yield locked
+            finally:
+                if locked:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        finally:
+            f.close()
+
+    def clear_js_cache(self):
+        """Remove all :xfile:`lino*.js` and :xfile:`linoweb.js` files so that
+        they get rebuilt when they are requested.
+
+        """
+        dn = self.get_js_cache_dir()
+        if not os.path.isdir(dn):
+            return
+        for fn in os.listdir(dn):
+            if fn in (SITE_CACHE_HASH_FILE, SITE_CACHE_LOCK_FILE):
+                continue
+            if fn.startswith(('lino_', 'linoweb_')):
+                pth = os.path.join(dn, fn)
+                if os.path.isdir(pth):
+                    # actor chunks (see lazy_actor_chunks)
+                    shutil.rmtree(pth)
+                else:
+                    # also their published variants
+                    os.remove(pth)
+
+    def get_js_cache_dir(self):
+        """Return the absolute name of the directory which contains the
+        :xfile:`lino*.js` files.
+
+        """
+        return os.path.join(settings.MEDIA_ROOT, *self.lino_js_parts()[:-1])
+
+    def read_site_cache_hash(self):
+        fn = os.path.join(self.get_js_cache_dir(), SITE_CACHE_HASH_FILE)
+        if not os.path.exists(fn):
+            return None
+        with open(fn) as f:
+            return f.read().strip()
+
+    def write_site_cache_hash(self, digest):
+        dn = self.get_js_cache_dir()
+        settings.SITE.makedirs_if_missing(dn)
+        fn = os.path.join(dn, SITE_CACHE_HASH_FILE)
+        with open(fn + '.tmp', 'w') as f:
+            f.write(digest + '\n')
+        replace_file(fn + '.tmp', fn)
+
+    def get_site_cache_hash(self):
+        """Return a hex digest which changes whenever the content of the
+        :xfile:`lino*.js` files may change.
+
+        """
+        h = hashlib.sha1()
+        for v in self.get_site_cache_inputs():
+            if not isinstance(v, bytes):
+                v = repr(v).encode('utf-8')
+            h.update(v)
+        return h.hexdigest()
+
+    def get_site_cache_inputs(self):
+        """Yield the values from which :meth:`get_site_cache_hash` computes
+        its digest: the versions, the modification time of the
+        application code, the site settings used by the templates, the
+        content of the templates and translation catalogs, the
+        layouts, the actors and their grid configs.
+
+        The generated Javascript also depends on model and field
+        definitions (verbose names, help texts, field types, ...) and
+        on the texts of choices, which are not listed here.  That's
+        why the modification time of the code is included: every code
+        deploy causes a rebuild, a mere restart of the processes
+        doesn't.
+
+        """
+        from lino_extjs6 import __version__
+        yield lino.__version__
+        yield __version__
+        yield settings.SITE.site_version()
+        yield settings.SITE.kernel.code_mtime
+
+        for k in sorted(dir(settings.SITE)):
+            if k.startswith('use_') or k.endswith('_format_extjs'):
+                yield (k, getattr(settings.SITE, k))
+        for k in sorted(dir(self.plugin)):
+            v = getattr(self.plugin, k)
+            if not k.startswith('_') and isinstance(
+                    v, six.string_types + (bool, int, float)):
+                yield (k, v)
+
+        for lng in settings.SITE.languages:
+            yield lng.django_code
+        for user_type in UserTypes.objects():
+            yield (user_type.value, user_type.role.__class__.__name__)
+
+        for fn in self.get_site_cache_files():
+            yield fn
+            with open(fn, 'rb') as f:
+                yield f.read()
+
+        layouts = list(self.form_panels) + list(self.param_panels) + \
+            list(self.action_param_panels)
+        for fl in sorted(layouts, key=lambda fl: fl._formpanel_name):
+            yield fl._formpanel_name
+            for k in dir(fl):
+                if not k.startswith('_'):
+                    v = getattr(fl, k, None)
+                    if isinstance(v, six.string_types + (tuple,)):
+                        yield (k, v)
+
+        for a in self.actors_list:
+            yield str(a)
+            yield a.get_handle_name is None
+            yield [ba.full_name() for ba in a.get_actions()]
+            yield sorted([r.__name__ for r in a.required_roles])
+            for k in ('column_names', 'editable', 'label', 'cell_edit',
+                      'use_paging'):
+                yield (k, str(getattr(a, k, None)))
+            yield sorted(getattr(a, 'hidden_columns', None) or [])
+            yield [gc.data for gc in getattr(a, 'grid_configs', [])]
+            if isinstance(a, type) and issubclass(a, choicelists.ChoiceList):
+                yield [(i.value, i.name) for i in a.get_list_items()]
+
+    def get_site_cache_files(self):
+        """Yield the names of the files whose content influences the
+        :xfile:`lino*.js` files: the Jinja templates and the
+        translation catalogs.
+
+        """
+        from django.apps import apps
+        yield self.linolib_template().filename
+        env = settings.SITE.plugins.jinja.renderer.jinja_env
+        for p in settings.SITE.installed_plugins:
+            if isinstance(p, Plugin):
+                for tplname in p.site_js_snippets:
+                    yield env.get_template(tplname).filename
+
+        dirs = list(settings.LOCALE_PATHS)
+        for ac in apps.get_app_configs():
+            dirs.append(os.path.join(ac.path, 'locale'))
+        for dn in dirs:
+            for root, dirnames, filenames in os.walk(dn):
+                dirnames.sort()
+                for fn in sorted(filenames):
+                    if fn.endswith('.mo'):
+                        yield os.path.join(root, fn)
+
+    def run_parallel_jobs(self, jobs, workers):
+        """Run :func:`build_js_cache_job` for each of the given `jobs` using a
+        pool of `workers` forked processes.  Return a list of the
+        results or `None` if the platform cannot fork.
+
+        """
+        import multiprocessing
+        from django.db import connections
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except AttributeError:  # Python 2 always forks on POSIX
+            if os.name != 'posix':
+                ctx = None
+            else:
+                ctx = multiprocessing
+        except ValueError:
+            ctx = None
+        if ctx is None:
+            logger.warning(
+                "Cannot build site cache in parallel on this platform.")
+            return None
+
+        # forked processes must not share the database connections of
+        # their parent
+        for conn in connections.all():
+            conn.close()
+
+        pool = ctx.Pool(min(workers, len(jobs)))
+        try:
+            return pool.map(build_js_cache_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    def build_js_cache_for(self, language, user_type_value, force):
+        """Build the :xfile:`lino*.js` file for the given language and user
+        type.  Return a tuple `(count, seconds)` where `count` is the
+        number of files built (0 or 1) and `seconds` the time it took.
+
+        """
+        started = time.time()
+        user_type = UserTypes.get_by_value(user_type_value)
+        with translation.override(language):
+            count = with_user_profile(user_type, self.build_js_cache, force)
+        return (count, time.time() - started)
+
+    def write_lino_js(self, f):
+        """Write the :xfile:`lino*.js` file for the current user type and
+        language.
+
+        Same as in ExtJS 3 except that the code generated for each
+        actor is delimited by :data:`ACTOR_BEGIN` and
+        :data:`ACTOR_END` comments so that it can be rewritten
+        individually.
+
+        The code which doesn't depend on the user type (the
+        :xfile:`linoweb.js` template and the `site_js_snippets` of
+        the plugins) is not included because it goes to a separate
+        file (see :meth:`linoweb_js_parts`).
+
+        When :attr:`lazy_actor_chunks
+        <lino_extjs6.extjs.Plugin.lazy_actor_chunks>` is set, the code
+        of each actor goes to a separate chunk file, together with the
+        panel classes which are used only by that actor, and the
+        :xfile:`lino*.js` file contains only the shared panel classes,
+        a manifest of the chunks and stubs which load them on first
+        use.
+
+        """
+
+        user_type = get_user_profile()
+
+        f.write("// lino.js --- generated %s by %s for %s.\n" % (
+            time.ctime(), escape(settings.SITE.site_version()), user_type))
+
+        menu = settings.SITE.get_site_menu(self, user_type)
+        menu.add_item(
+            'home', _("Home"), javascript="Lino.handle_home_button()")
+        f.write("Lino.main_menu = %s;\n" % py2js(menu))
+
+        # Call Ext.namespace for *all* actors because e.g.
+        # outbox.Mails.FormPanel is defined in ns outbox.Mails which
+        # is not directly used by non-expert users.
+        for a in self.actors_list:
+            f.write("Ext.namespace('Lino.%s')\n" % a)
+
+        actors_list = self.get_visible_actors(user_type)
+
+        # Define every choicelist as a JS array:
+        f.write("\n// ChoiceLists: \n")
+        for a in list(choicelists.CHOICELISTS.values()):
+            if settings.SITE.is_installed(a.app_label):
+                f.write("Lino.%s = %s;\n" %
+                        (a.actor_id, py2js(a.get_choices())))
+
+        lazy = self.plugin.lazy_actor_chunks
+        # the actors whose GridPanel is used in each panel class
+        panel_refs = dict()
+        # the name and code of each panel class (when lazy)
+        panels = []
+
+        def write_panel(lh, lines):
+            if lazy:
+                code = ''.join([ln + '\n' for ln in lines])
+                name = lh.layout._formpanel_name
+                panel_refs[name] = set(GRID_PANEL_REF.findall(code))
+                panels.append((name, code))
+            else:
+                for ln in lines:
+                    f.write(ln + '\n')
+
+        def must_render(lh, user_type):
+            """Return True if the given form layout `fl` is needed for
+            user_type."""
+            if not lh.main.get_view_permission(user_type):
+                return False
+            if lh.layout._datasource.get_view_permission(user_type):
+                return True
+            for ds in lh.layout._other_datasources:
+                if ds.get_view_permission(user_type):
+                    return True
+            return False
+
+        for fl in self.param_panels:
+            lh = fl.get_layout_handle(self.plugin)
+            if must_render(lh, user_type):
+                write_panel(lh, self.js_render_ParamsPanelSubclass(lh))
+
+        for fl in self.action_param_panels:
+            lh = fl.get_layout_handle(self.plugin)
+            if must_render(lh, user_type):
+                write_panel(lh, self.js_render_ActionFormPanelSubclass(lh))
+
+        for fl in self.form_panels:
+            lh = fl.get_layout_handle(self.plugin)
+            if must_render(lh, user_type):
+                write_panel(lh, self.js_render_FormPanelSubclass(lh))
+
+        action_lines = []
+        actions_written = set()
+        for rpt in actors_list:
+            rh = rpt.get_handle()
+            for ba in rpt.get_actions():
+                if ba.action.parameters:
+                    if ba.action not in actions_written:
+                        actions_written.add(ba.action)
+                        action_lines.extend(self.js_render_window_action(
+                            rh, ba, user_type))
+
+        if lazy:
+            # A panel class used by a single actor goes to the chunk
+            # of that actor, the others stay in the lino*.js file.
+            codes = dict()
+            used_by = dict()
+            for rpt in actors_list:
+                codes[rpt] = ''.join([
+                    ln + '\n' for ln in self.js_render_actor(
+                        rpt.get_handle(), user_type)])
+                for name in find_class_refs(codes[rpt], panel_refs):
+                    used_by.setdefault(name, set()).add(rpt)
+            shared = find_class_refs('\n'.join(action_lines), panel_refs)
+            for name, code in panels:
+                shared |= find_class_refs(code, panel_refs) - set([name])
+            own = dict()
+            for name, code in panels:
+                users = used_by.get(name, set())
+                if len(users) == 1 and name not in shared:
+                    rpt = users.pop()
+                    own[rpt] = own.get(rpt, '') + code
+                else:
+                    f.write(code)
+
+        for ln in action_lines:
+            f.write(ln + '\n')
+
+        if lazy:
+            chunks = dict()
+            for rpt in actors_list:
+                code = self.write_actor_chunk(
+                    rpt, codes[rpt], own.get(rpt, ''))
+                parts = self.published_parts(self.lino_js_chunk_parts(rpt))
+                chunks[str(rpt)] = dict(
+                    url=settings.SITE.build_media_url(*parts),
+                    requires=self.get_chunk_requires(rpt, code, panel_refs))
+            visible = set(chunks.keys())
+            for c in chunks.values():
+                c['requires'] = sorted(visible & c['requires'])
+            f.write("Lino.chunks = %s;\n" % py2js(chunks))
+
+        for rpt in actors_list:
+            f.write(ACTOR_BEGIN % rpt + '\n')
+            if lazy:
+                lines = self.js_render_actor_stubs(rpt.get_handle())
+            else:
+                lines = self.js_render_actor(rpt.get_handle(), user_type)
+            for ln in lines:
+                f.write(ln + '\n')
+            f.write(ACTOR_END % rpt + '\n')
+
+        if user_type != get_user_profile():
+            logger.warning(
+                "Oops, user_type %s != get_user_profile() %s",
+                user_type, get_user_profile())
+
+        return 1
+
+    def linolib_intro(self):
+        """Called from :xfile:`linoweb.js`.
+
+        Same as in ExtJS 3 except that it doesn't mention the user type
+        nor the time because the :xfile:`linoweb.js` file is shared
+        by all user types and its name depends on its content.
+
+        """
+        def fn():
+            yield "// linoweb.js --- generated by %s for %s." % (
+                escape(settings.SITE.site_version()),
+                translation.get_language())
+            yield "LANGUAGE_CHOICES = %s;" % py2js(
+                list(settings.SITE.LANGUAGE_CHOICES))
+            yield "MEDIA_URL = %s;" % py2js(settings.SITE.build_media_url())
+
+        return '\n'.join(fn())
+
+    def linoweb_js_parts(self):
+        """Return the parts of the url of the :xfile:`linoweb.js` file for
+        the current language.  Called from :xfile:`extjs/index.html`.
+
+        This file contains the code which is the same for all user
+        types.  Its name contains a hash of its content, so browsers
+        and proxies can cache it forever.  It is rendered once per
+        process and language, and written only if it doesn't exist.
+
+        """
+        lang = translation.get_language()
+        if self.linoweb_names is None:
+            self.linoweb_names = dict()
+        name = self.linoweb_names.get(lang)
+        if name is None or not os.path.exists(
+                os.path.join(self.get_js_cache_dir(), name)):
+            name = self.build_linoweb_js()
+            self.linoweb_names[lang] = name
+        return self.lino_js_parts()[:-1] + (name,)
+
+    def build_linoweb_js(self):
+        """Write the :xfile:`linoweb.js` file for the current language unless
+        it exists.  Return its name.
+
+        """
+        code = self.render_linoweb_js()
+        name = 'linoweb_%s_%s.js' % (
+            translation.get_language(),
+            hashlib.sha1(code.encode('utf-8')).hexdigest()[:12])
+        dn = self.get_js_cache_dir()
+        fn = os.path.join(dn, name)
+        if not self.is_published(fn):
+            self.write_cache_file(fn, lambda f: f.write(code))
+            # Keep the most recent previous version (for browsers which
+            # still have a page referring to it), remove the others.
+            prefix = 'linoweb_%s_' % translation.get_language()
+            others = [
+                os.path.join(dn, other) for other in os.listdir(dn)
+                if other.startswith(prefix) and other != name
+                and other.endswith('.js') and not other.endswith('.min.js')]
+            others.sort(key=os.path.getmtime)
+            for other in others[:-1]:
+                self.remove_cache_file(other)
+        return name
+
+    def render_linoweb_js(self):
+        """Return the content of the :xfile:`linoweb.js` file for the current
+        language: the rendered :xfile:`linoweb.js` template followed by
+        the `site_js_snippets` of all plugins.
+
+        """
+        context = dict(
+            ext_renderer=self,
+            site=settings.SITE,
+            settings=settings,
+            lino=lino,
+            language=translation.get_language(),
+            constants=constants,
+            extjs=self.plugin,
+        )
+
+        context.update(_=_)
+
+        tpl = self.linolib_template()
+        chunks = [tpl.render(**context) + '\n']
+
+        env = settings.SITE.plugins.jinja.renderer.jinja_env
+        for p in settings.SITE.installed_plugins:
+            if isinstance(p, Plugin):
+                for tplname in p.site_js_snippets:
+                    tpl = env.get_template(tplname)
+                    chunks.append('\n// from %s:%s\n' % (p, tplname))
+                    chunks.append('\n' + tpl.render(**context) + '\n')
+        return ''.join(chunks)
+
+    def get_visible_actors(self, user_type):
+        """Return the actors for which :meth:`js_render_actor` must be
+        called for the given user type.
+
+        """
+        # actors with their own `get_handle_name` don't have a js
+        # implementation
+        return [
+            a for a in self.actors_list
+            if a.get_handle_name is None
+            and a.default_action.get_view_permission(user_type)]
+
+    def js_render_actor(self, rh, user_type):
+        """Yield the lines of Javascript code which depend only on the
+        given actor handle: its GridPanel class, its detail and insert
+        panels and its window actions.
+
+        """
+        rpt = rh.actor
+        if isinstance(rpt, type) and issubclass(rpt, (
+                tables.AbstractTable, choicelists.ChoiceList)):
+            for ln in self.js_render_GridPanel_class(rh):
+                yield ln
+
+        for ba in rpt.get_actions():
+            if ba.action.parameters and not ba.action.no_params_window:
+                pass
+            elif ba.action.opens_a_window:
+                if isinstance(ba.action, (ShowDetail, ShowInsert)):
+                    for ln in self.js_render_detail_action_FormPanel(
+                            rh, ba):
+                        yield ln
+                for ln in self.js_render_window_action(rh, ba, user_type):
+                    yield ln
+            elif ba.action.action_name:
+                for ln in self.js_render_custom_action(rh, ba):
+                    yield ln
+
+    def lino_js_chunk_parts(self, actor):
+        """Like :meth:`lino_js_parts`, but for the chunk file of the given
+        actor.  The chunks of a :xfile:`lino*.js` file are in a
+        directory of the same name (without the ``.js``).
+
+        """
+        parts = self.lino_js_parts()
+        return parts[:-1] + (parts[-1][:-3], '%s.js' % actor)
+
+    def write_actor_chunk(self, actor, code, panels=''):
+        """Write the chunk file of the given actor for the current user type
+        and language and return its content: the given `panels` (the
+        code of the panel classes used only by this actor) followed by
+        the given `code` of the actor (see :meth:`js_render_actor`),
+        which is delimited by :data:`ACTOR_BEGIN` and :data:`ACTOR_END`
+        comments.
+
+        """
+        content = panels + ACTOR_BEGIN % actor + '\n' + code + \
+            ACTOR_END % actor + '\n'
+        fn = os.path.join(settings.MEDIA_ROOT,
+                          *self.lino_js_chunk_parts(actor))
+        self.write_cache_file(fn, lambda f: f.write(content))
+        return content
+
+    def get_chunk_requires(self, actor, code, panel_refs):
+        """Return the set of actors whose chunks must be loaded together with
+        the chunk of the given actor because their GridPanel class is
+        used by the given `code`, either directly or (as a slave
+        grid) in one of the panel classes it uses.  `panel_refs` maps
+        the names of these panel classes to the actors they use.
+
+        """
+        refs = set(GRID_PANEL_REF.findall(code))
+        for name in find_class_refs(code, panel_refs):
+            refs |= panel_refs[name]
+        refs.discard(str(actor))
+        return refs
+
+    def js_render_actor_stubs(self, rh):
+        """Yield the stubs which replace the code of :meth:`js_render_actor`
+        in a :xfile:`lino*.js` file with :attr:`lazy_actor_chunks
+        <lino_extjs6.extjs.Plugin.lazy_actor_chunks>`.  Every window
+        action and custom action of the actor is defined as a stub
+        which loads the chunk of the actor and then calls the real
+        thing.
+
+        """
+        rpt = rh.actor
+        for ba in rpt.get_actions():
+            if ba.action.parameters and not ba.action.no_params_window:
+                pass
+            elif ba.action.opens_a_window:
+                if isinstance(ba.action, (
+                        ShowDetail, ShowInsert, ShowTable)) \
+                   or ba.action.extjs_main_panel:
+                    yield "Lino.%s = Lino.lazy_window_action(%s, %s);" % (
+                        ba.full_name(), py2js(str(rpt)),
+                        py2js(ba.full_name()))
+            elif ba.action.action_name:
+                yield "Lino.%s = Lino.lazy_function(%s, %s);" % (
+                    ba.full_name(), py2js(str(rpt)), py2js(ba.full_name()))
+
+    def rebuild_actor_js(self, actor):
+        """Rewrite the code generated for the given actor in every existing
+        :xfile:`lino*.js` file (all user types and languages), leaving
+        the remaining code untouched.
+
+        This is much cheaper than :meth:`build_site_cache` and is
+        used e.g. when a grid config has been saved.
+
+        """
+        started = time.time()
+        count = 0
+        with self.lock_site_cache():
+            for lng in settings.SITE.languages:
+                with translation.override(lng.django_code):
+                    for user_type in UserTypes.objects():
+                        count += with_user_profile(
+                            user_type, self.rebuild_actor_fragment, actor)
+            if self.site_cache_current:
+                # grid configs are part of the site cache hash
+                self.write_site_cache_hash(self.get_site_cache_hash())
+        logger.info("Rewrote %s in %d lino*.js files in %s seconds.",
+                    actor, count, time.time() - started)
+
+    def rebuild_actor_fragment(self, actor):
+        """Rewrite the code generated for the given actor in the
+        :xfile:`lino*.js` file of the current user type and language.
+        Return 1 if the file has been rewritten, otherwise 0.
+
+        """
+        fn = os.path.join(settings.MEDIA_ROOT, *self.lino_js_parts())
+        if not os.path.exists(fn):
+            return 0
+        if self.plugin.lazy_actor_chunks:
+            # the stubs don't change, only the chunk
+            chunk = os.path.join(settings.MEDIA_ROOT,
+                                 *self.lino_js_chunk_parts(actor))
+            if not os.path.exists(chunk):
+                return 0
+            old = self.get_published_name(chunk)
+            with codecs.open(chunk, 'r', encoding='utf-8') as f:
+                content = f.read()
+            # keep the panel classes which precede the code of the actor
+            i = content.find(ACTOR_BEGIN % actor + '\n')
+            code = ''.join([ln + '\n' for ln in self.js_render_actor(
+                actor.get_handle(), get_user_profile())])
+            self.write_actor_chunk(
+                actor, code, content[:i] if i > 0 else '')
+            new = self.get_published_name(chunk)
+            if old != new:
+                # the manifest refers to the old name
+                with codecs.open(fn, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                self.write_cache_file(
+                    fn, lambda f: f.write(content.replace(old, new)))
+            return 1
+        with codecs.open(fn, 'r', encoding='utf-8') as f:
+            content = f.read()
+        begin = ACTOR_BEGIN % actor + '\n'
+        end = ACTOR_END % actor + '\n'
+        i = content.find(begin)
+        if i == -1:
+            # the actor is not visible for this user type
+            return 0
+        j = content.find(end, i)
+        if j == -1:
+            logger.warning("%s has no end marker for %s", fn, actor)
+            return 0
+        lines = self.js_render_actor(actor.get_handle(), get_user_profile())
+        fragment = ''.join([ln + '\n' for ln in lines])
+
+        def write(f):
+            f.write(content[:i + len(begin)])
+            f.write(fragment)
+            f.write(content[j:])
+
+        self.write_cache_file(fn, write)
+        return 1
+
     def js_render_ParamsPanelSubclass(self, dh):
         yield ""
         yield "Lino.%s = Ext.extend(Ext.form.FormPanel, {" % \
@@ -0,0 +1,180 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Keyset (or "cursor") pagination for the JSON responses of
+:class:`lino_extjs6.extjs.views.ApiList`.
+
+With classic pagination the database must skip `start` rows before
+returning a page (``OFFSET``), which gets slower the deeper the user
+scrolls into a big table.  With keyset pagination the response of a
+page contains a cursor which describes its last row, and the client
+sends this cursor back when asking for the following page.  The query
+then becomes "the first `limit` rows after this one", which can use
+an index and costs the same for every page.
+
+This is used only when :attr:`keyset_pagination
+<lino_extjs6.extjs.Plugin.keyset_pagination>` is set, and only for
+querysets whose ordering consists of non-nullable local fields.  The
+primary key is added to the ordering as a tie-breaker.
+
+"""
+
+from __future__ import unicode_literals
+
+import six
+import json
+import uuid
+import decimal
+import hashlib
+import datetime
+from builtins import str
+
+from django.conf import settings
+from django.db import models
+from django.db.models import Q
+from django.core.exceptions import FieldDoesNotExist, EmptyResultSet
+from django.core.exceptions import ValidationError
+
+URL_PARAM_CURSOR = 'cursor'
+
+
+def get_keyset(qs):
+    """Return a list of tuples `(name, field, descending)` which describe
+    the ordering of the given queryset, or `None` if that ordering
+    cannot be used for keyset pagination.
+
+    """
+    query = qs.query
+    model = qs.model
+    if query.extra_order_by:
+        return None
+    if query.order_by:
+        ordering = query.order_by
+    elif query.default_ordering:
+        ordering = model._meta.ordering
+    else:
+        ordering = []
+    pk = model._meta.pk
+    keyset = []
+    for o in ordering:
+        if not isinstance(o, six.string_types):
+            return None  # an expression
+        desc = o.startswith('-')
+        name = o.lstrip('-')
+        if name == 'pk':
+            name = pk.name
+        if '__' in name or name == '?':
+            return None
+        try:
+            fld = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None  # e.g. an annotation
+        if fld is pk:
+            keyset.append(('pk', fld, desc))
+            break  # pk is unique, the rest doesn't matter
+        if fld.null or fld.is_relation or not fld.concrete:
+            return None
+        keyset.append((name, fld, desc))
+    else:
+        keyset.append(('pk', pk, False))
+    return keyset
+
+
+def keyset_filter(keyset, values):
+    """Return a :class:`Q` object which selects the rows which come after
+    the row having the given `values` in the ordering described by
+    `keyset`.
+
+    """
+    q = None
+    for i, (name, fld, desc) in enumerate(keyset):
+        kw = {name + ('__lt' if desc else '__gt'): values[i]}
+        for j in range(i):
+            kw[keyset[j][0]] = values[j]
+        q = Q(**kw) if q is None else q | Q(**kw)
+    return q
+
+
+def encode_value(value):
+    """Return the given cursor value in a form which can be stored as
+    JSON without losing precision.  Dates and times are sent as ISO
+    strings with all their microseconds (unlike
+    :class:`DjangoJSONEncoder`, which truncates them to
+    milliseconds), and they are converted back using the
+    :meth:`to_python` method of their field.
+
+    """
+    if isinstance(value, (datetime.datetime, datetime.date,
+                          datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+def get_fingerprint(qs):
+    """Return a short string which identifies the given queryset (its
+    filter conditions and ordering).  A cursor is valid only for the
+    queryset it was made for.
+
+    """
+    try:
+        sql = six.text_type(qs.query)
+    except EmptyResultSet:
+        sql = ''
+    return hashlib.sha1(sql.encode('utf-8')).hexdigest()[:12]
+
+
+def get_page(ar, cursor=None):
+    """Return a tuple `(rows, next_cursor)` with the rows of the page
+    requested by the given table request and the cursor to be used for
+    requesting the next page.  `next_cursor` is `None` when keyset
+    pagination is not possible or when this is the last page,
+    otherwise a dict with the keys `start` (the offset of the next
+    page) and `value` (the opaque value to send back as
+    :data:`URL_PARAM_CURSOR`).
+
+    If the given `cursor` doesn't match the request (e.g. because the
+    filter conditions have changed in between), it is ignored and we
+    fall back to classic pagination.
+
+    """
+    if not settings.SITE.plugins.extjs.keyset_pagination:
+        return ar.sliced_data_iterator, None
+    qs = ar.data_iterator
+    if not isinstance(qs, models.QuerySet) or ar.limit is None \
+       or ar.offset == -1:
+        return ar.sliced_data_iterator, None
+    keyset = get_keyset(qs)
+    if keyset is None:
+        return ar.sliced_data_iterator, None
+    qs = qs.order_by(*[
+        ('-' if desc else '') + name for name, fld, desc in keyset])
+    fingerprint = get_fingerprint(qs)
+    offset = ar.offset or 0
+
+    page = None
+    if cursor:
+        try:
+            c = json.loads(cursor)
+            if c['q'] == fingerprint and c['o'] == offset \
+               and len(c['v']) == len(keyset):
+                values = [fld.to_python(v)
+                          for (name, fld, desc), v in zip(keyset, c['v'])]
+                page = qs.filter(keyset_filter(keyset, values))[:ar.limit]
+        except (ValueError, KeyError, TypeError, ValidationError):
+            # a malformed cursor, use classic pagination
+            page = None
+    if page is None:
+        page = qs[offset:offset + ar.limit]
+
+    rows = list(page)
+    if len(rows) < ar.limit:
+        return rows, None
+    last = rows[-1]
+    c = dict(o=offset + len(rows), q=fingerprint,
+             v=[encode_value(getattr(
+                 last, 'pk' if name == 'pk' else fld.attname))
+                for name, fld, desc in keyset])
+    return rows, dict(start=c['o'], value=json.dumps(c))
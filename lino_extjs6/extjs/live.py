@@ -0,0 +1,360 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Pushing the changed rows to the open grids of all users (see
+:attr:`live_grids <lino_extjs6.extjs.Plugin.live_grids>`).
+
+This uses `channels <https://channels.readthedocs.io>`__ version 1,
+like :mod:`lino.modlib.notify`.  The routing of the site must include
+the :data:`channel_routing` (for the WebSocket connections of the
+clients) and the :data:`worker_routing` (for sending the changed
+rows) of this module, e.g.::
+
+    from channels.routing import include
+    channel_routing = [
+        include('lino_extjs6.extjs.live.channel_routing',
+                path=r'^/extjs/rows'),
+        include('lino_extjs6.extjs.live.worker_routing'),
+        include('lino.modlib.notify.routing.channel_routing'),
+    ]
+
+When a grid has been loaded, the client sends a subscription message
+containing the actor and the parameters of the grid.  All grids of a
+same user showing the same actor with the same parameters and
+language share a channel group.  The Django cache holds the
+subscription of every group, the number of connections subscribed to
+it, and for each model the list of the groups which show rows of that
+model.  A group is removed when its last connection unsubscribes or
+disconnects.
+
+When a row is saved or deleted (see :mod:`lino_extjs6.extjs.models`),
+a message is sent to the :data:`ROWS_CHANNEL` after the transaction
+has been committed.  A worker then sends to each group of the model a
+message with the pk of the deleted row or with the new data of the
+saved row (as returned by :meth:`row2list
+<lino.core.store.Store.row2list>`), and the client patches its store
+in place.  A saved row which no longer belongs to the grid is sent as
+deleted.
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+import time
+import hashlib
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+from django import http
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.test.client import RequestFactory
+from django.utils import translation
+
+from channels import Channel, Group
+from channels.auth import channel_session_user, channel_session_user_from_http
+from channels.routing import route
+
+from lino.core import constants
+from lino.core.views import requested_actor, action_request
+from lino.utils.jsgen import py2js
+
+from .serializers import get_row2list
+
+ROWS_CHANNEL = 'extjs6.rows'
+"""The channel which receives the changed rows to be sent to the
+grids."""
+
+SUBSCRIPTION_TIMEOUT = 24 * 3600
+"""The number of seconds after which a subscription which has not been
+renewed is forgotten, e.g. when a server process died without
+disconnecting its clients."""
+
+LOCK_TIMEOUT = 5
+"""The number of seconds after which the lock on the list of groups of
+a model is released even if its holder didn't release it."""
+
+IGNORED_PARAMS = (
+    '_dc', 'cursor', 'columnar', 'page',
+    constants.URL_PARAM_START, constants.URL_PARAM_LIMIT,
+    constants.URL_PARAM_SORT, constants.URL_PARAM_SORTDIR,
+    constants.URL_PARAM_FORMAT, constants.URL_PARAM_REQUESTING_PANEL,
+    constants.URL_PARAM_COLUMNS, constants.URL_PARAM_HIDDENS,
+    constants.URL_PARAM_WIDTHS)
+"""The grid parameters which don't influence which rows are shown nor
+how they are serialized."""
+
+
+def get_groups_key(label):
+    return 'extjs6.live.' + label
+
+
+def get_spec_key(group):
+    return 'extjs6.live.spec.' + group
+
+
+def get_count_key(group):
+    return 'extjs6.live.count.' + group
+
+
+def get_group(spec):
+    """Return the name of the channel group for the given subscription."""
+    data = json.dumps(spec, sort_keys=True)
+    return 'extjs6.rows.' + hashlib.sha1(
+        data.encode('utf-8')).hexdigest()[:20]
+
+
+@contextmanager
+def cache_lock(key):
+    """Hold a lock which is shared by all processes using the same cache.
+    Give up waiting after :data:`LOCK_TIMEOUT` seconds.
+
+    """
+    lock = key + '.lock'
+    deadline = time.time() + LOCK_TIMEOUT
+    while not cache.add(lock, 1, LOCK_TIMEOUT):
+        if time.time() > deadline:
+            logger.warning("Ignoring stale lock %s", lock)
+            break
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        cache.delete(lock)
+
+
+def subscribe(user, actor_id, params, language=None, known=()):
+    """Register a subscription of a connection of the given user to the
+    rows of the given actor (e.g. ``contacts/Persons``) in the given
+    language and return `(group, spec)`, or `(None, None)` if the user
+    may not see this actor.
+
+    `known` are the groups to which the connection is already
+    subscribed.  A subscription to one of them is just renewed,
+    otherwise it must be matched by a call to :func:`unsubscribe`.
+
+    """
+    try:
+        app_label, name = actor_id.split('/')
+        actor = requested_actor(app_label, name)
+    except (ValueError, http.Http404):
+        return None, None
+    model = getattr(actor, 'model', None)
+    if model is None or not isinstance(model, type) \
+       or not issubclass(model, models.Model) \
+       or not actor.get_view_permission(user.user_type):
+        return None, None
+    if language not in [
+            lng.django_code for lng in settings.SITE.languages]:
+        language = settings.SITE.DEFAULT_LANGUAGE.django_code
+    spec = dict(
+        actor=actor_id, model=model._meta.label_lower, user=user.pk,
+        language=language,
+        params=dict([(k, v if isinstance(v, list) else [v])
+                     for k, v in params.items()
+                     if k not in IGNORED_PARAMS]))
+    group = get_group(spec)
+    key = get_groups_key(spec['model'])
+    with cache_lock(key):
+        cache.set(get_spec_key(group), spec, SUBSCRIPTION_TIMEOUT)
+        count_key = get_count_key(group)
+        if group not in known:
+            cache.add(count_key, 0, SUBSCRIPTION_TIMEOUT)
+            try:
+                cache.incr(count_key)
+            except ValueError:  # expired in the meantime
+                cache.set(count_key, 1, SUBSCRIPTION_TIMEOUT)
+        groups = cache.get(key) or []
+        if group not in groups:
+            groups.append(group)
+        cache.set(key, groups, SUBSCRIPTION_TIMEOUT)
+    return group, spec
+
+
+def unsubscribe(group):
+    """Unregister a connection from the given group.  Forget the
+    subscription when no connection is left.
+
+    """
+    spec = cache.get(get_spec_key(group))
+    if spec is None:
+        return
+    key = get_groups_key(spec['model'])
+    count_key = get_count_key(group)
+    with cache_lock(key):
+        try:
+            n = cache.decr(count_key)
+        except ValueError:  # expired
+            n = 0
+        if n > 0:
+            return
+        cache.delete_many([get_spec_key(group), count_key])
+        groups = cache.get(key) or []
+        if group in groups:
+            groups.remove(group)
+            cache.set(key, groups, SUBSCRIPTION_TIMEOUT)
+
+
+def get_rows_data(spec, pks):
+    """Return a dict which maps the given primary keys to the data of
+    their row as it is shown in the grid of the given subscription.
+    The rows which that grid doesn't show are missing.
+
+    """
+    user = settings.SITE.user_model.objects.get(pk=spec['user'])
+    request = RequestFactory().get('/', spec['params'])
+    request.user = user
+    request.subst_user = None
+    request.requesting_panel = None
+    app_label, name = spec['actor'].split('/')
+    with translation.override(spec['language']):
+        ar = action_request(
+            app_label, name, request, request.GET, True,
+            renderer=settings.SITE.kernel.extjs_renderer)
+        qs = ar.data_iterator
+        if not isinstance(qs, models.QuerySet):
+            return dict()
+        row2list = get_row2list(ar.ah.store)
+        return dict([(row.pk, row2list(ar, row))
+                     for row in qs.filter(pk__in=pks)])
+
+
+def send_changes(label, pks, created=False, deleted=False):
+    """Send the given changed rows of the given model to all subscribed
+    grids.  Called by the worker which handles the
+    :data:`ROWS_CHANNEL`.
+
+    """
+    key = get_groups_key(label)
+    groups = cache.get(key)
+    if not groups:
+        return
+    specs = cache.get_many([get_spec_key(g) for g in groups])
+    for group in groups:
+        spec = specs.get(get_spec_key(group))
+        if spec is None:  # expired
+            with cache_lock(key):
+                current = cache.get(key) or []
+                if group in current:
+                    current.remove(group)
+                    cache.set(key, current, SUBSCRIPTION_TIMEOUT)
+            continue
+        msg = dict(type='rows', group=group, actor=spec['actor'])
+        if deleted:
+            msg.update(deleted=pks)
+        else:
+            try:
+                data = get_rows_data(spec, pks)
+            except Exception:
+                logger.exception("Failed to serialize %s %s for %s",
+                                 label, pks, spec['actor'])
+                continue
+            rows = [data[pk] for pk in pks if pk in data]
+            msg.update(deleted=[pk for pk in pks if pk not in data])
+            if created:
+                msg.update(created=rows)
+            else:
+                msg.update(updated=rows)
+        Group(group).send({'text': py2js(msg)})
+
+
+def push_changes(model, pks, created=False, deleted=False):
+    """Have the given rows of the given model sent to all subscribed grids
+    when the current transaction has been committed.
+
+    This only sends a message to the :data:`ROWS_CHANNEL`, the rows
+    are serialized by a worker process.
+
+    """
+    pks = [pk for pk in pks if pk is not None]
+    if not pks:
+        return
+    label = model._meta.label_lower
+
+    def send():
+        if cache.get(get_groups_key(label)):
+            Channel(ROWS_CHANNEL).send(dict(
+                model=label, pks=pks, created=created, deleted=deleted))
+
+    transaction.on_commit(send)
+
+
+def push_change(model, obj, created=False, deleted=False):
+    """Same as :func:`push_changes` for a single row."""
+    push_changes(model, [obj.pk], created, deleted)
+
+
+def rows_changed(message):
+    """Consumer of the :data:`ROWS_CHANNEL`."""
+    c = message.content
+    try:
+        apps.get_model(c['model'])
+    except (LookupError, ValueError):
+        return
+    send_changes(c['model'], c['pks'], c['created'], c['deleted'])
+
+
+@channel_session_user_from_http
+def ws_connect(message):
+    message.reply_channel.send(
+        {'accept': bool(message.user.is_authenticated)})
+
+
+@channel_session_user
+def ws_receive(message):
+    """Handle a message from the client: either ``{"subscribe": id,
+    "actor": actor_id, "params": {...}, "language": lang}`` or
+    ``{"unsubscribe": group}``.
+
+    """
+    try:
+        data = json.loads(message.content['text'])
+    except ValueError:
+        return
+    groups = message.channel_session.get('groups', [])
+    if 'unsubscribe' in data:
+        group = data['unsubscribe']
+        if group in groups:
+            Group(group).discard(message.reply_channel)
+            groups.remove(group)
+            unsubscribe(group)
+    elif 'subscribe' in data:
+        if not message.user.is_authenticated:
+            return
+        group, spec = subscribe(
+            message.user, data.get('actor', ''), data.get('params') or {},
+            data.get('language'), groups)
+        if group is None:
+            return
+        Group(group).add(message.reply_channel)
+        if group not in groups:
+            groups.append(group)
+        message.reply_channel.send({'text': json.dumps(dict(
+            type='subscribed', id=data['subscribe'], group=group))})
+    message.channel_session['groups'] = groups
+
+
+@channel_session_user
+def ws_disconnect(message):
+    for group in message.channel_session.get('groups', []):
+        Group(group).discard(message.reply_channel)
+        unsubscribe(group)
+
+
+channel_routing = [
+    route('websocket.connect', ws_connect),
+    route('websocket.receive', ws_receive),
+    route('websocket.disconnect', ws_disconnect),
+]
+"""The routing of the WebSocket consumers of this module."""
+
+worker_routing = [
+    route(ROWS_CHANNEL, rows_changed),
+]
+"""The routing of the worker which sends the changed rows."""
@@ -17,6 +17,11 @@ from lino.api import dd
 
 from lino.modlib.users.desktop import Users, UserDetail
 from django.db import models
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from lino.core.signals import pre_ui_delete
+
+from .datacache import bump_generation, uses_generations
 
 EXTJS6_THEMES_CHOICES = (
     ("theme-classic", "Theme classic"),
@@ -49,3 +54,57 @@ class ThemedUserDetail(UserDetail):
 
 
 Users.set_detail_layout(ThemedUserDetail())
+
+
+def on_row_change(sender, raw=False, **kw):
+    """Invalidate the cached data which depends on the table of the saved
+    or deleted row.  See :mod:`lino_extjs6.extjs.datacache`.
+
+    """
+    if not raw:
+        bump_generation(sender)
+
+
+def on_row_saved(sender, instance=None, created=False, raw=False, **kw):
+    """Push the saved row to the open grids when :attr:`live_grids
+    <lino_extjs6.extjs.Plugin.live_grids>` is set.  See
+    :mod:`lino_extjs6.extjs.live`.
+
+    """
+    if not raw:
+        from .live import push_change
+        push_change(sender, instance, created=created)
+
+
+def on_row_deleted(sender, instance=None, **kw):
+    """Same as :func:`on_row_saved` for a deleted row."""
+    from .live import push_change
+    push_change(sender, instance, deleted=True)
+
+
+def on_ui_delete(sender, **kw):
+    """Same as :func:`on_row_change` for a row which is going to be
+    deleted by the user.  Here the sender is the row itself.
+
+    """
+    bump_generation(sender.__class__)
+
+
+def on_m2m_change(sender, instance=None, **kw):
+    bump_generation(sender)  # the intermediate model
+    if instance is not None:
+        bump_generation(instance.__class__)
+
+
+# Every receiver costs something for every write to the database, so
+# we connect them only when they are needed.
+
+if uses_generations():
+    post_save.connect(on_row_change)
+    post_delete.connect(on_row_change)
+    pre_ui_delete.connect(on_ui_delete)
+    m2m_changed.connect(on_m2m_change)
+
+if dd.plugins.extjs.live_grids:
+    post_save.connect(on_row_saved)
+    post_delete.connect(on_row_deleted)
@@ -0,0 +1,214 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Adapting the queryset of a table request to the columns which are
+going to be serialized.
+
+Without this, every foreign key column and every remote field (like
+``partner__city``) of a grid causes one database query per row (the
+"N+1 queries" problem).  :func:`optimize_request` adds the needed
+:meth:`select_related` and :meth:`prefetch_related` calls.
+
+:func:`project_request` moreover avoids loading and serializing the
+columns which the user has hidden.
+
+"""
+
+from __future__ import unicode_literals
+
+import six
+import logging
+
+logger = logging.getLogger(__name__)
+
+from django.db import models
+from django.core.exceptions import FieldDoesNotExist
+
+from lino.core import constants
+from lino.core import fields
+
+try:
+    from django.contrib.contenttypes.fields import GenericForeignKey
+except ImportError:
+    GenericForeignKey = None
+
+
+def get_hidden_columns(ar):
+    """Return the set of the names of the columns which are hidden in the
+    grid of the given table request.
+
+    If the request specifies the columns (as done by the client for
+    exports and when :attr:`column_projection
+    <lino_extjs6.extjs.Plugin.column_projection>` is set), use these.  Otherwise use the columns which are hidden
+    by default, including those hidden by the default grid config.
+
+    """
+    rqdata = ar.rqdata
+    if rqdata is not None:
+        columns = rqdata.getlist(constants.URL_PARAM_COLUMNS)
+        if columns:
+            hiddens = rqdata.getlist(constants.URL_PARAM_HIDDENS)
+            return set([
+                cn for cn, h in zip(columns, hiddens) if h == 'true'])
+    hidden = set([
+        e.name for e in ar.ah.list_layout.main.columns if e.hidden])
+    if ar.actor.grid_configs:
+        data = ar.actor.grid_configs[constants.DEFAULT_GC_NAME].data
+        for cn, h in zip(data.get('columns', []), data.get('hiddens', [])):
+            if h:
+                hidden.add(cn)
+            else:
+                hidden.discard(cn)
+    return hidden
+
+
+def is_related_path(model, path):
+    """Whether the given path (e.g. ``partner__city``) consists only of
+    forward foreign keys or one-to-one fields, starting from the given
+    model.  Only such paths can be used with :meth:`select_related`.
+
+    """
+    for name in path.split('__'):
+        try:
+            fld = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        if not (fld.many_to_one or fld.one_to_one) or not fld.concrete:
+            return False
+        model = fld.remote_field.model
+    return True
+
+
+def get_related_plan(model, store_fields, hidden=frozenset()):
+    """Return a tuple `(select, prefetch)` with the paths to be given to
+    :meth:`select_related` and :meth:`prefetch_related` of a queryset
+    on the given model in order to serialize the given store fields.
+    Fields whose name is in `hidden` are ignored.
+
+    """
+    select = set()
+    prefetch = set()
+    for sf in store_fields:
+        if sf.name in hidden:
+            continue
+        fld = sf.field
+        if isinstance(fld, fields.RemoteField):
+            parts = fld.name.split('__')
+            candidates = ['__'.join(parts[:-1]), fld.name]
+        elif GenericForeignKey is not None and \
+                isinstance(fld, GenericForeignKey):
+            if fld.model is model or issubclass(model, fld.model):
+                prefetch.add(fld.name)
+            continue
+        elif isinstance(fld, models.ForeignKey):
+            candidates = [fld.name]
+        else:
+            continue
+        for path in candidates:
+            if is_related_path(model, path):
+                select.add(path)
+    # a path makes its prefixes redundant
+    for path in list(select):
+        parts = path.split('__')
+        for i in range(1, len(parts)):
+            select.discard('__'.join(parts[:i]))
+    return sorted(select), sorted(prefetch)
+
+
+def optimize_request(ar, store_fields=None):
+    """Add :meth:`select_related` and :meth:`prefetch_related` to the
+    querysets of the given table request for serializing the given
+    store fields (default is the list fields of its store).
+
+    Returns the number of relations which are now fetched together with
+    the rows (see :func:`log_saved_queries`).
+
+    """
+    qs = ar.data_iterator  # executes the request
+    if not isinstance(qs, models.QuerySet):
+        return 0
+    if store_fields is None:
+        store_fields = ar.ah.store.list_fields
+    select, prefetch = get_related_plan(
+        qs.model, store_fields, get_hidden_columns(ar))
+    if not select and not prefetch:
+        return 0
+
+    def optimize(qs):
+        if select:
+            qs = qs.select_related(*select)
+        if prefetch:
+            qs = qs.prefetch_related(*prefetch)
+        return qs
+
+    ar._data_iterator = optimize(qs)
+    if isinstance(ar._sliced_data_iterator, models.QuerySet):
+        ar._sliced_data_iterator = optimize(ar._sliced_data_iterator)
+    logger.debug("%s : select_related(%s), prefetch_related(%s)",
+                 ar.actor, select, prefetch)
+    return len(select) + len(prefetch)
+
+
+def project_request(ar):
+    """Restrict the querysets of the given table request to the visible
+    columns of its grid (see :attr:`column_projection
+    <lino_extjs6.extjs.Plugin.column_projection>`).
+
+    Defers the model fields of hidden columns and the text and binary
+    fields which are not a column at all, except those used for
+    ordering and those which are traversed by :func:`optimize_request`
+    (which must therefore be called first).
+
+    Returns a set with the names of the store fields which need not be
+    serialized: the virtual fields of hidden columns and the deferred
+    fields.
+
+    """
+    qs = ar.data_iterator
+    hidden = get_hidden_columns(ar)
+    store = ar.ah.store
+    skipped = set()
+    for sf in store.list_fields:
+        if sf.name in hidden and getattr(sf, 'vf', None) is not None:
+            skipped.add(sf.name)
+    if not isinstance(qs, models.QuerySet):
+        return skipped
+
+    columns = set([sf.name for sf in store.list_fields])
+    traversed = qs.query.select_related
+    if not isinstance(traversed, dict):
+        traversed = {}
+    ordering = qs.query.order_by or qs.model._meta.ordering
+    keep = set(traversed)
+    keep.update([o.lstrip('-') for o in ordering
+                 if isinstance(o, six.string_types)])
+    defer = []
+    for fld in qs.model._meta.concrete_fields:
+        if fld.primary_key or fld.name in keep:
+            continue
+        if fld.name in columns:
+            if fld.name not in hidden:
+                continue
+        elif not isinstance(fld, (models.TextField, models.BinaryField)):
+            continue
+        defer.append(fld.name)
+    if defer:
+        ar._data_iterator = qs.defer(*defer)
+        if isinstance(ar._sliced_data_iterator, models.QuerySet):
+            ar._sliced_data_iterator = ar._sliced_data_iterator.defer(
+                *defer)
+        skipped.update([n for n in defer if n in columns])
+        logger.debug("%s : defer(%s)", ar.actor, defer)
+    return skipped
+
+
+def log_saved_queries(ar, relations, nrows):
+    """Log how many queries have been saved (at most) by
+    :func:`optimize_request` for serializing `nrows` rows.
+
+    """
+    if relations:
+        logger.debug("%s : %d rows with %d relations, saved up to %d "
+                     "queries", ar.actor, nrows, relations,
+                     nrows * relations)
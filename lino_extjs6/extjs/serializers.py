@@ -0,0 +1,203 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Precompiled row serializers.
+
+:meth:`Store.row2list <lino.core.store.Store.row2list>` and
+:meth:`Store.row2dict <lino.core.store.Store.row2dict>` walk over the
+store fields for every row and call two methods for each of them.  For
+most fields (plain database fields of type char, integer, decimal,
+date, ...) these methods do nothing more than reading an attribute of
+the row.  The functions returned by :func:`get_row2list` and
+:func:`get_row2dict` are compiled once per store: they read all these
+attributes using a single :func:`operator.attrgetter` call and use the
+generic methods only for the other fields.
+
+Use :func:`benchmark` to compare both.
+
+"""
+
+from __future__ import unicode_literals
+from __future__ import print_function
+
+import time
+from operator import attrgetter
+
+from django.db import models
+
+from lino.core.store import StoreField
+from lino.core.requests import PhantomRow
+
+
+def get_attname(sf):
+    """Return the name of the attribute which holds the value of the given
+    store field if it can be read directly, otherwise `None`.
+
+    """
+    cls = sf.__class__
+    if cls.full_value_from_object is not StoreField.full_value_from_object:
+        return None
+    fld = sf.field
+    if not isinstance(fld, models.Field):
+        return None
+    if fld.__class__.value_from_object is not models.Field.value_from_object:
+        return None
+    return fld.attname
+
+
+def compile_plan(fields, method, skipped=frozenset()):
+    """Return a list of steps for serializing the given store fields.  A
+    step is either a tuple `(attrgetter, names)` for a group of
+    consecutive fields which can be read directly, an integer `n` for
+    `n` values which are not computed (`None`), or a store field whose
+    methods must be called.  `method` is the name of the method
+    (`value2list` or `value2dict`) which must not be overridden for a
+    field to be read directly.  The fields whose name is in `skipped`
+    are not computed.
+
+    """
+    plan = []
+    attnames = []
+    names = []
+
+    def flush():
+        if attnames:
+            plan.append((attrgetter(*attnames), tuple(names)))
+            del attnames[:]
+            del names[:]
+
+    for sf in fields:
+        if sf.name in skipped:
+            flush()
+            n = sf.list_values_count
+            if plan and isinstance(plan[-1], int):
+                plan[-1] += n
+            else:
+                plan.append(n)
+            continue
+        attname = get_attname(sf)
+        if attname is None or \
+           getattr(sf.__class__, method) is not getattr(StoreField, method):
+            flush()
+            plan.append(sf)
+        else:
+            attnames.append(attname)
+            names.append(str(sf.name))
+    flush()
+    return plan
+
+
+def get_row2list(store, skipped=frozenset()):
+    """Return a function `row2list(ar, row)` which does the same as
+    :meth:`store.row2list <lino.core.store.Store.row2list>`, except
+    that the fields whose name is in `skipped` are sent as `None`.
+
+    """
+    cache = store.__dict__.setdefault('_compiled_row2list', dict())
+    key = frozenset(skipped)
+    f = cache.get(key)
+    if f is not None:
+        return f
+    plan = compile_plan(store.list_fields, 'value2list', key)
+
+    def row2list(ar, row):
+        if isinstance(row, PhantomRow):
+            return store.row2list(ar, row)
+        l = []
+        for step in plan:
+            if isinstance(step, tuple):
+                getter, names = step
+                if len(names) == 1:
+                    l.append(getter(row))
+                else:
+                    l.extend(getter(row))
+            elif isinstance(step, int):
+                l.extend([None] * step)
+            else:
+                step.value2list(
+                    ar, step.full_value_from_object(row, ar), l, row)
+        return l
+
+    cache[key] = row2list
+    return row2list
+
+
+def get_row2dict(store, fields=None):
+    """Return a function `row2dict(ar, row, **d)` which does the same as
+    :meth:`store.row2dict <lino.core.store.Store.row2dict>` for the
+    given `fields` (default is the detail fields).
+
+    """
+    if fields is None:
+        fields = store.detail_fields
+    cache = store.__dict__.setdefault('_compiled_row2dict', dict())
+    key = tuple(fields)
+    f = cache.get(key)
+    if f is not None:
+        return f
+    plan = compile_plan(fields, 'value2dict')
+
+    def row2dict(ar, row, **d):
+        for step in plan:
+            if isinstance(step, tuple):
+                getter, names = step
+                if len(names) == 1:
+                    d[names[0]] = getter(row)
+                else:
+                    d.update(zip(names, getter(row)))
+            else:
+                step.value2dict(
+                    ar, step.full_value_from_object(row, ar), d, row)
+        return d
+
+    cache[key] = row2dict
+    return row2dict
+
+
+def benchmark(actor, username=None, limit=None, repeat=3):
+    """Serialize the rows of the given actor using both the generic and
+    the compiled serializer, check that they give the same result and
+    print the number of rows per second for each.
+
+    Usage example in a Lino demo project::
+
+        $ python manage.py shell
+        >>> from lino.api import rt
+        >>> from lino_extjs6.extjs.serializers import benchmark
+        >>> benchmark(rt.models.contacts.Persons, 'robin')
+
+    """
+    from lino.api import rt
+    user = None
+    if username is not None:
+        user = rt.models.users.User.objects.get(username=username)
+    ar = actor.request(user=user, limit=limit)
+    store = ar.ah.store
+    rows = list(ar.sliced_data_iterator)
+    if not rows:
+        print("No rows to serialize.")
+        return
+    compiled = get_row2list(store)
+    for row in rows:
+        if store.row2list(ar, row) != compiled(ar, row):
+            raise Exception("Different results for {}".format(row))
+
+    def measure(f):
+        best = None
+        for i in range(repeat):
+            started = time.time()
+            for row in rows:
+                f(ar, row)
+            elapsed = time.time() - started
+            if best is None or elapsed < best:
+                best = elapsed
+        return len(rows) / max(best, 1e-9)
+
+    generic = measure(store.row2list)
+    fast = measure(compiled)
+    print("{}: {} rows, {} fields".format(
+        actor, len(rows), len(store.list_fields)))
+    print("generic row2list : {:.0f} rows/s".format(generic))
+    print("compiled row2list : {:.0f} rows/s ({:.1f}x)".format(
+        fast, fast / generic))
@@ -28,6 +28,12 @@ Summary from <http://en.wikipedia.org/wiki/Restful>:
 from __future__ import unicode_literals
 
 import ast
+import six
+import copy
+import hashlib
+from multiprocessing.pool import ThreadPool
+from xml.sax.saxutils import quoteattr
+from six.moves.urllib.parse import urlsplit
 
 from builtins import str
 import logging
@@ -35,14 +41,23 @@ import logging
 logger = logging.getLogger(__name__)
 
 from django import http
-from django.db import models
+from django.db import models, connections, transaction, IntegrityError
+from django.db.models import prefetch_related_objects
+from django.core.exceptions import ValidationError
+from django.core.exceptions import PermissionDenied, SuspiciousOperation
 from django.conf import settings
+from django.urls import resolve, get_script_prefix
+from django.utils import timezone
+from django.utils import translation
 from django.views.generic import View
 import json
 from django.utils.translation import ugettext as _
 from django.utils.encoding import force_text
+from django.utils.cache import get_conditional_response
+from django.utils.cache import patch_cache_control
 
-from lino.core.signals import pre_ui_delete
+from lino.core.signals import pre_ui_delete, pre_ui_save, on_ui_created
+from lino.core.diff import ChangeWatcher
 from lino.core.utils import obj2unicode
 
 from etgen import html as xghtml
@@ -64,14 +79,219 @@ from lino.core.requests import BaseRequest
 
 from lino.modlib.extjs.views import RunJasmine, EidAppletService, Callbacks, elem2rec_empty, choices_for_field, choices_response
 
+from . import keyset
+from . import delta
+from .queryplan import optimize_request, project_request
+from .queryplan import log_saved_queries
+from .datacache import get_total_count, get_page_key, page_cache
+from .datacache import bump_generation
+from .serializers import get_row2list, get_row2dict
+from .choices import cached_choices_response
 
-MAX_ROW_COUNT = 300
+
+URL_PARAM_COLUMNAR = 'columnar'
+
+STREAMING_CHUNK_SIZE = 1000
+"""The number of rows to fetch from the database and render at once when
+streaming a large response."""
 
 
 class HttpResponseDeleted(http.HttpResponse):
     status_code = 204
 
 
+def conditional_response(request, response):
+    """Add a weak ETag computed from the content of the given response
+    and return a `304 Not Modified` response instead if the client
+    already has this content (i.e. if it sent the same ETag in its
+    `If-None-Match` header).
+
+    The response may be stored by the browser but must be revalidated
+    every time.
+
+    """
+    etag = 'W/"%s"' % hashlib.sha1(response.content).hexdigest()
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+def dictionary_key(v):
+    """Return a hashable key for the given JSON value.  The key includes
+    the type of the value because e.g. `True`, `1` and `1.0` are equal
+    in Python but not in JSON.
+
+    """
+    if v is None or isinstance(
+            v, six.string_types + six.integer_types + (bool, float)):
+        return (type(v), v)
+    return (type(v), json.dumps(v, sort_keys=True, default=force_text))
+
+
+def rows2columns(rows):
+    """Convert the given list of rows (as returned by
+    :meth:`row2list`) into a list of columns.
+
+    A column with less distinct values than half the number of rows
+    is dictionary-encoded: instead of a list of values it is a dict
+    with the distinct values (`d`) and, for each row, the index of its
+    value in that list (`i`).
+
+    """
+    n = len(rows)
+    if n == 0:
+        return []
+    columns = []
+    for j in range(len(rows[0])):
+        col = [row[j] for row in rows]
+        values = []
+        index = dict()
+        indexes = []
+        for v in col:
+            k = dictionary_key(v)
+            i = index.get(k)
+            if i is None:
+                i = index[k] = len(values)
+                values.append(v)
+            indexes.append(i)
+        if len(values) * 2 <= n:
+            columns.append(dict(d=values, i=indexes))
+        else:
+            columns.append(col)
+    return columns
+
+
+class StreamBuffer(object):
+    """A file-like object which collects what is written to it until it
+    gets drained.
+
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def drain(self):
+        if not self.chunks:
+            return b''
+        data = self.chunks[0][:0].join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_chunks(data_iterator, size=STREAMING_CHUNK_SIZE):
+    """Yield lists of at most `size` rows from the given data iterator.
+
+    A queryset is iterated using its :meth:`iterator` method, which
+    doesn't fill its result cache (and uses a server-side cursor where
+    the database supports it), so memory usage doesn't grow with the
+    number of rows.  Since :meth:`iterator` ignores the
+    :meth:`prefetch_related` lookups of the queryset, these are done
+    for each chunk.
+
+    """
+    lookups = ()
+    if isinstance(data_iterator, models.QuerySet):
+        lookups = data_iterator._prefetch_related_lookups
+        data_iterator = data_iterator.iterator()
+
+    def finish(chunk):
+        if lookups:
+            prefetch_related_objects(chunk, *lookups)
+        return chunk
+
+    chunk = []
+    for row in data_iterator:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield finish(chunk)
+            chunk = []
+    if chunk:
+        yield finish(chunk)
+
+
+def stream_csv(ar):
+    """Yield the content of a CSV file with the rows of the given table
+    request, one chunk at a time.
+
+    """
+    rh = ar.ah
+    buf = StreamBuffer()
+    w = ucsv.UnicodeWriter(buf, **settings.SITE.csv_params)
+    w.writerow(rh.store.column_names())
+    if True:  # 20130418 : also column headers, not only internal names
+        column_names = None
+        fields, headers, cellwidths = ar.get_field_info(column_names)
+        w.writerow(headers)
+    yield buf.drain()
+    row2list = get_row2list(rh.store)
+    relations = optimize_request(ar)
+    nrows = 0
+    for rows in iter_chunks(ar.data_iterator):
+        for row in rows:
+            w.writerow([str(v) for v in row2list(ar, row)])
+        nrows += len(rows)
+        yield buf.drain()
+    log_saved_queries(ar, relations, nrows)
+
+
+def stream_printer_html(ar):
+    """Yield a printable HTML document with the rows of the given table
+    request, one chunk at a time.
+
+    The document is the same as the one produced by
+    :meth:`dump2html <lino.core.tablerequest.TableRequest.dump2html>`
+    into an :class:`etgen.html.Document`, but we never hold more than
+    one chunk of rows in memory.
+
+    """
+    renderer = ar.renderer
+    cellattrs = renderer.cellattrs
+    title = force_text(ar.get_title())
+
+    def tostring(e):
+        return E.tostring(e).encode('utf-8')
+
+    attrib = dict(renderer.tableattrs)
+    attrib.setdefault('name', ar.bound_action.full_name())
+    yield ("<html><head>%s</head><body>%s<table %s>" % (
+        E.tostring(E.title(title)), E.tostring(E.h1(title)),
+        ' '.join(['%s=%s' % (k, quoteattr(str(v)))
+                  for k, v in sorted(attrib.items())]))).encode('utf-8')
+
+    grid = ar.ah.list_layout.main
+    fields, headers, cellwidths = ar.get_field_info()
+    columns = fields
+    sums = [fld.zero for fld in columns]
+    if not ar.actor.hide_headers:
+        headers = [
+            x for x in grid.headers2html(ar, columns, headers, **cellattrs)]
+        if cellwidths and renderer.is_interactive:
+            for i, td in enumerate(headers):
+                td.set('width', str(cellwidths[i]))
+        yield b"<thead>" + tostring(E.tr(*headers)) + b"</thead>"
+
+    yield b"<tbody>"
+    recno = 0
+    relations = optimize_request(ar)
+    for rows in iter_chunks(ar.data_iterator):
+        chunk = []
+        for obj in rows:
+            cells = ar.row2html(recno, columns, obj, sums, **cellattrs)
+            if cells is not None:
+                recno += 1
+                chunk.append(tostring(E.tr(*cells)))
+        yield b''.join(chunk)
+
+    if recno == 0:
+        yield tostring(E.tr(E.td(str(ar.no_data_text))))
+    elif not ar.actor.hide_sums and any(sums):
+        yield tostring(E.tr(*ar.sums2html(columns, sums, **cellattrs)))
+    yield b"</tbody></table></body></html>"
+    log_saved_queries(ar, relations, recno)
+
+
 def delete_element(ar, elem):
     if elem is None:
         raise Warning("Cannot delete None")
@@ -100,6 +320,69 @@ def delete_element(ar, elem):
     return HttpResponseDeleted()
 
 
+def delete_elements(ar, pks):
+    """Delete the rows with the given primary keys and return a JSON
+    response which reports the deleted rows and the rows which could
+    not be deleted.
+
+    The rows are loaded using a single query, and :meth:`disable_delete
+    <lino.core.model.Model.disable_delete>` is checked for all of them
+    before deleting anything.  The rows are deleted in a single
+    transaction, but the failure of one row (e.g. because other rows
+    refer to it) doesn't prevent the others from being deleted.
+
+    Returns :class:`HttpResponseForbidden` if the user may not delete
+    rows of this table at all.
+
+    """
+    actor = ar.actor
+    if not actor.editable or actor.delete_action is None \
+       or not actor.delete_action.get_view_permission(
+           ar.get_user().user_type):
+        return http.HttpResponseForbidden()
+    if actor.model is None:
+        rows = [(pk, actor.get_row_by_pk(ar, pk)) for pk in pks]
+    else:
+        objects = actor.model.objects.in_bulk(pks)
+        objects = dict([(str(k), v) for k, v in objects.items()])
+        rows = [(pk, objects.get(str(pk))) for pk in pks]
+
+    failures = []
+    todo = []
+    for pk, elem in rows:
+        if elem is None:
+            failures.append(dict(pk=pk, message=NOT_FOUND % (actor, pk)))
+            continue
+        msg = actor.disable_delete(elem, ar)
+        if msg is not None:
+            failures.append(dict(pk=pk, message=str(msg)))
+        else:
+            todo.append((pk, elem))
+
+    deleted = []
+    with transaction.atomic():
+        for pk, elem in todo:
+            try:
+                # a failure also rolls back what the receivers wrote
+                with transaction.atomic():
+                    pre_ui_delete.send(sender=elem, request=ar.request)
+                    elem.delete()
+            except Exception as e:
+                dblogger.exception(e)
+                failures.append(dict(pk=pk, message=_(
+                    "Failed to delete %(record)s : %(error)s.") % dict(
+                        record=obj2unicode(elem), error=e)))
+            else:
+                deleted.append(pk)
+
+    msg = _("%d rows have been deleted.") % len(deleted)
+    if failures:
+        msg += " " + _("%d rows could not be deleted.") % len(failures)
+    return json_response(dict(
+        success=not failures, deleted=deleted, failures=failures,
+        message=msg))
+
+
 class AdminIndex(View):
     """
     Similar to PlainIndex
@@ -145,7 +428,8 @@ class ActionParamChoices(View):
             emptyValue = ''
         else:
             emptyValue = None
-        return choices_response(actor, request, qs, row2dict, emptyValue)
+        return cached_choices_response(
+            actor, ba.action, request, qs, row2dict, emptyValue)
 
 
 class Choices(View):
@@ -191,37 +475,135 @@ class Choices(View):
                 emptyValue = ''
             qs, row2dict = choices_for_field(request, rpt, field)
 
-        return choices_response(rpt, request, qs, row2dict, emptyValue)
+        return cached_choices_response(
+            rpt, rpt, request, qs, row2dict, emptyValue)
+
+
+def save_rows(ar, rows, elems, is_new):
+    """Fill the given database objects with the given rows of data (a list
+    of dicts as sent by the client) and save them, all or nothing.
+    Must be called within a transaction.
+
+    All rows are validated before anything is saved, and the errors of
+    all invalid rows are reported together.  Raises
+    :class:`BulkSaveError` with a list of dicts with the `index` of an
+    invalid row and its `message`.  Returns the list of messages about
+    the saved rows.
+
+    """
+    store = ar.ah.store
+    watchers = []
+    errors = []
+    for i, (data, elem) in enumerate(zip(rows, elems)):
+        watchers.append(None if is_new else ChangeWatcher(elem))
+        try:
+            store.form2obj(ar, data, elem, is_new)
+            elem.full_clean()
+        except ValidationError as e:
+            errors.append(dict(index=i, message='; '.join(e.messages)))
+        except Warning as e:
+            errors.append(dict(index=i, message=str(e)))
+    if errors:
+        raise BulkSaveError(errors)
+    messages = []
+    for i, (elem, watcher) in enumerate(zip(elems, watchers)):
+        if is_new or watcher.is_dirty():
+            pre_ui_save.send(sender=elem.__class__, instance=elem, ar=ar)
+            elem.before_ui_save(ar)
+            try:
+                if is_new:
+                    elem.save(force_insert=True)
+                else:
+                    elem.save(force_update=True)
+            except IntegrityError as e:
+                raise BulkSaveError([dict(index=i, message=str(e))])
+            if is_new:
+                on_ui_created.send(elem, request=ar.request)
+                msg = _("%s has been created.") % obj2unicode(elem)
+            else:
+                watcher.send_update(ar)
+                msg = _("%s has been updated.") % obj2unicode(elem)
+        else:
+            msg = _("%s : nothing to save.") % obj2unicode(elem)
+        ar.success(msg)
+        messages.append(msg)
+        elem.after_ui_save(ar, watcher)
+    return messages
+
+
+def bulk_save_response(ar, rows, elems, is_new):
+    """Save the given rows using :func:`save_rows` in a single transaction
+    and return the JSON response with all saved rows.
+
+    """
+    try:
+        with transaction.atomic():
+            messages = save_rows(ar, rows, elems, is_new)
+    except BulkSaveError as e:
+        return json_response(dict(
+            success=False, errors=e.errors,
+            message=_("%d of %d rows are invalid. Nothing was saved.") % (
+                len(e.errors), len(rows))))
+    row2dict = get_row2dict(ar.ah.store, ar.ah.store.list_fields)
+    ar.set_response(
+        success=True, rows=[row2dict(ar, elem) for elem in elems],
+        message='<br/>'.join(
+            [_("%d rows have been saved.") % len(elems)] + messages))
+    return json_response(ar.response)
+
+
+class BulkSaveError(Exception):
+    """Raised to roll back the transaction of a bulk save."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(BulkSaveError, self).__init__(errors)
 
 
 class Restful(View):
     """
     Used to collaborate with a restful Ext.data.Store.
+
+    A DELETE without primary key deletes the rows given by
+    :data:`URL_PARAM_SELECTED <lino.core.constants.URL_PARAM_SELECTED>`
+    (see :func:`delete_elements`).
+
+    The `rows` parameter of a POST or PUT may also be a list of rows.
+    In that case all these rows are created (POST) or updated (PUT) in
+    a single transaction.  For a PUT, each row must contain its primary
+    key.
     """
 
     def post(self, request, app_label=None, actor=None, pk=None):
         rpt = requested_actor(app_label, actor)
         ar = rpt.request(request=request)
 
+        data = json.loads(request.POST.get('rows'))
+        if isinstance(data, list):
+            elems = [ar.create_instance() for row in data]
+            return bulk_save_response(ar, data, elems, True)
+
         instance = ar.create_instance()
         # store uploaded files.
         # html forms cannot send files with PUT or GET, only with POST
         if ar.actor.handle_uploaded_files is not None:
             ar.actor.handle_uploaded_files(instance, request)
 
-        data = request.POST.get('rows')
-        data = json.loads(data)
         ar.form2obj_and_save(data, instance, True)
 
         # Ext.ensible needs list_fields, not detail_fields
         ar.set_response(
-            rows=[ar.ah.store.row2dict(
-                ar, instance, ar.ah.store.list_fields)])
+            rows=[get_row2dict(ar.ah.store, ar.ah.store.list_fields)(
+                ar, instance)])
         return json_response(ar.response)
 
     def delete(self, request, app_label=None, actor=None, pk=None):
         rpt = requested_actor(app_label, actor)
         ar = rpt.request(request=request)
+        if pk is None:
+            data = http.QueryDict(request.body)
+            return delete_elements(
+                ar, data.getlist(constants.URL_PARAM_SELECTED))
         ar.set_selected_pks(pk)
         return delete_element(ar, ar.selected_rows[0])
 
@@ -230,29 +612,42 @@ class Restful(View):
         assert pk is None, 20120814
         ar = rpt.request(request=request)
         rh = ar.ah
-        rows = [
-            rh.store.row2dict(ar, row, rh.store.list_fields)
-            for row in ar.sliced_data_iterator]
-        kw = dict(count=ar.get_total_count(), rows=rows)
+        row2dict = get_row2dict(rh.store, rh.store.list_fields)
+        relations = optimize_request(ar)
+        rows = [row2dict(ar, row) for row in ar.sliced_data_iterator]
+        log_saved_queries(ar, relations, len(rows))
+        kw = dict(count=get_total_count(ar), rows=rows)
         kw.update(title=str(ar.get_title()))
         return json_response(kw)
 
     def put(self, request, app_label=None, actor=None, pk=None):
         rpt = requested_actor(app_label, actor)
+        data = json.loads(http.QueryDict(request.body).get('rows'))
+        if isinstance(data, list):
+            a = rpt.get_url_action(rpt.default_list_action_name)
+            ar = rpt.request(request=request, action=a)
+            ar.renderer = settings.SITE.kernel.extjs_renderer
+            pk_name = getattr(ar.ah.store.pk, 'name', 'id')
+            elems = []
+            for row in data:
+                elem = ar.get_row_by_pk(row.get(pk_name, row.get('id')))
+                if elem is None:
+                    raise http.Http404(NOT_FOUND % (rpt, row.get(pk_name)))
+                elems.append(elem)
+            return bulk_save_response(ar, data, elems, False)
+
         ar = rpt.request(request=request)
         ar.set_selected_pks(pk)
         elem = ar.selected_rows[0]
         rh = ar.ah
 
-        data = http.QueryDict(request.body).get('rows')
-        data = json.loads(data)
         a = rpt.get_url_action(rpt.default_list_action_name)
         ar = rpt.request(request=request, action=a)
         ar.renderer = settings.SITE.kernel.extjs_renderer
         ar.form2obj_and_save(data, elem, False)
         # Ext.ensible needs list_fields, not detail_fields
         ar.set_response(
-            rows=[rh.store.row2dict(ar, elem, rh.store.list_fields)])
+            rows=[get_row2dict(rh.store, rh.store.list_fields)(ar, elem)])
         return json_response(ar.response)
 
 
@@ -303,7 +698,8 @@ class ApiElement(View):
                         success=False, message=NOT_FOUND % (rpt, pk))
                 else:
                     datarec = ar.elem2rec_detailed(elem)
-                return json_response(datarec)
+                return conditional_response(
+                    request, json_response(datarec))
 
             after_show = ar.get_status(record_id=pk)
             tab = request.GET.get(constants.URL_PARAM_TAB, None)
@@ -367,7 +763,38 @@ class ApiElement(View):
         return delete_element(ar, elem)
 
 
+def delta_response(ar, since, since_token):
+    """Return the response to a table request which asks only for the
+    rows which changed since the given time.  See
+    :mod:`lino_extjs6.extjs.delta`.
+
+    """
+    optimize_request(ar)
+    rows, deleted = delta.get_delta(
+        ar, since, ar.limit or settings.SITE.plugins.extjs.max_delta_rows)
+    if rows is None:
+        return json_response(dict(success=True, delta=False))
+    row2list = get_row2list(ar.ah.store)
+    return json_response(dict(
+        success=True, delta=True, since_token=since_token,
+        count=get_total_count(ar), deleted=deleted,
+        rows=[row2list(ar, row) for row in rows]))
+
+
 class ApiList(View):
+    def delete(self, request, app_label=None, actor=None):
+        """Delete the rows whose primary keys are given as
+        :data:`URL_PARAM_SELECTED <lino.core.constants.URL_PARAM_SELECTED>`
+        using :func:`delete_elements`.
+
+        """
+        data = http.QueryDict(request.body)
+        ar = action_request(
+            app_label, actor, request, data, True,
+            renderer=settings.SITE.kernel.extjs_renderer)
+        return delete_elements(
+            ar, data.getlist(constants.URL_PARAM_SELECTED))
+
     def post(self, request, app_label=None, actor=None):
         ar = action_request(app_label, actor, request, request.POST, True)
         ar.renderer = settings.SITE.kernel.extjs_renderer
@@ -390,12 +817,41 @@ class ApiList(View):
             ar.bound_action.action.default_format)
 
         if fmt == constants.URL_FORMAT_JSON:
-            rows = [rh.store.row2list(ar, row)
-                    for row in ar.sliced_data_iterator]
-            total_count = ar.get_total_count()
+            since_token = None
+            qs = ar.data_iterator
+            if settings.SITE.plugins.extjs.delta_refresh \
+               and isinstance(qs, models.QuerySet) \
+               and delta.is_supported(qs.model):
+                since_token = delta.get_token()
+                since = delta.parse_token(
+                    request.GET.get(delta.URL_PARAM_SINCE))
+                if since is not None:
+                    return delta_response(ar, since, since_token)
+            key = None
+            if page_cache.is_enabled(ar.actor):
+                # the since_token is part of the content
+                key = get_page_key(
+                    ar, ar.data_iterator, ('_dc', keyset.URL_PARAM_CURSOR),
+                    since_token)
+                if key is not None:
+                    content = page_cache.get(key)
+                    if content is not None:
+                        return conditional_response(
+                            request, http.HttpResponse(
+                                content, content_type='application/json'))
+            relations = optimize_request(ar)
+            skipped = frozenset()
+            if settings.SITE.plugins.extjs.column_projection:
+                skipped = project_request(ar)
+            page, next_cursor = keyset.get_page(
+                ar, request.GET.get(keyset.URL_PARAM_CURSOR))
+            row2list = get_row2list(rh.store, skipped)
+            rows = [row2list(ar, row) for row in page]
+            log_saved_queries(ar, relations, len(rows))
+            total_count = get_total_count(ar)
             for row in ar.create_phantom_rows():
                 if ar.limit is None or len(rows) + 1 < ar.limit or ar.limit == total_count + 1:
-                    d = rh.store.row2list(ar, row)
+                    d = row2list(ar, row)
                     rows.append(d)
                 total_count += 1
             # assert len(rows) <= ar.limit
@@ -404,11 +860,22 @@ class ApiList(View):
                       success=True,
                       no_data_text=ar.no_data_text,
                       title=str(ar.get_title()))
+            if next_cursor is not None:
+                kw.update(next_cursor=next_cursor)
+            if since_token is not None:
+                kw.update(since_token=since_token)
+            if request.GET.get(URL_PARAM_COLUMNAR):
+                # see Lino.ColumnarJsonReader
+                del kw['rows']
+                kw.update(columns=rows2columns(rows), nrows=len(rows))
             if ar.actor.parameters:
                 kw.update(
                     param_values=ar.actor.params_layout.params_store.pv2dict(
                         ar, ar.param_values))
-            return json_response(kw)
+            response = json_response(kw)
+            if key is not None:
+                page_cache.set(key, response.content)
+            return conditional_response(request, response)
 
         if fmt == constants.URL_FORMAT_HTML:
             after_show = ar.get_status()
@@ -436,7 +903,10 @@ class ApiList(View):
         if fmt == 'csv':
             # ~ response = HttpResponse(mimetype='text/csv')
             charset = settings.SITE.csv_params.get('encoding', 'utf-8')
-            response = http.HttpResponse(
+            # stream the rows instead of building the whole file in
+            # memory
+            response = http.StreamingHttpResponse(
+                stream_csv(ar),
                 content_type='text/csv;charset="%s"' % charset)
             if False:
                 response['Content-Disposition'] = \
@@ -447,34 +917,209 @@ class ApiList(View):
                     'inline; filename="%s.csv"' % ar.actor
 
             # ~ response['Content-Disposition'] = 'attachment; filename=%s.csv' % ar.get_base_filename()
-            w = ucsv.UnicodeWriter(response, **settings.SITE.csv_params)
-            w.writerow(ar.ah.store.column_names())
-            if True:  # 20130418 : also column headers, not only internal names
-                column_names = None
-                fields, headers, cellwidths = ar.get_field_info(column_names)
-                w.writerow(headers)
-
-            for row in ar.data_iterator:
-                w.writerow([str(v) for v in rh.store.row2list(ar, row)])
             return response
 
         if fmt == constants.URL_FORMAT_PRINTER:
-            if ar.get_total_count() > MAX_ROW_COUNT:
+            max_rows = settings.SITE.plugins.extjs.max_printable_rows
+            if max_rows is not None and ar.get_total_count() > max_rows:
                 raise Exception(_("List contains more than %d rows") %
-                                MAX_ROW_COUNT)
-            response = http.HttpResponse(
+                                max_rows)
+            # stream the rows instead of building the whole document in
+            # memory
+            return http.StreamingHttpResponse(
+                stream_printer_html(ar),
                 content_type='text/html;charset="utf-8"')
-            doc = xghtml.Document(force_text(ar.get_title()))
-            doc.body.append(E.h1(doc.title))
-            t = doc.add_table()
-            # ~ settings.SITE.kernel.ar2html(ar,t,ar.data_iterator)
-            ar.dump2html(t, ar.data_iterator)
-            doc.write(response, encoding='utf-8')
-            return response
 
         return settings.SITE.kernel.run_action(ar)
 
 
+class Resequence(View):
+    """Move a row of a table with a :attr:`drag_drop_sequenced_field
+    <lino.core.actors.Actor.drag_drop_sequenced_field>` to another
+    position.
+
+    Expects the primary key `pk` of the moved row and the sequence
+    number `target` it should get.  The siblings between the old and
+    the new position are renumbered by a single bulk UPDATE, all in
+    one transaction.  Returns the new sequence numbers of the changed
+    rows as a list `changed` of `[pk, seqno]` pairs.
+
+    This assumes that the siblings are numbered without duplicates.
+    Bulk updates don't send any signals, so e.g. no change records are
+    written for the renumbered siblings.
+
+    """
+    def post(self, request, app_label=None, actor=None):
+        ar = action_request(
+            app_label, actor, request, request.POST, True,
+            renderer=settings.SITE.kernel.extjs_renderer)
+        rpt = ar.actor
+        name = rpt.drag_drop_sequenced_field
+        if name is None or not rpt.editable or rpt.update_action is None \
+           or not rpt.update_action.get_view_permission(
+               ar.get_user().user_type):
+            return http.HttpResponseForbidden()
+        pk = request.POST.get('pk')
+        try:
+            target = int(request.POST.get('target'))
+        except (TypeError, ValueError):
+            return http.HttpResponseBadRequest("Invalid target")
+        elem = ar.get_row_by_pk(pk)
+        if elem is None:
+            raise http.Http404(NOT_FOUND % (rpt, pk))
+        if not rpt.get_row_permission(
+                elem, ar, rpt.get_row_state(elem), rpt.update_action):
+            return http.HttpResponseForbidden()
+
+        model = elem.__class__
+        if hasattr(elem, 'get_siblings'):
+            siblings = elem.get_siblings()
+        else:
+            siblings = model.objects.all()
+        siblings = siblings.exclude(pk=elem.pk)
+        old = getattr(elem, name)
+        if old == target:
+            return json_response(dict(success=True, changed=[]))
+        # bulk updates don't send signals, so we must touch the
+        # timestamp and notify the caches and the live grids ourselves
+        touch = dict()
+        ts = delta.get_timestamp_field(model)
+        if ts is not None:
+            touch[ts] = timezone.now()
+        with transaction.atomic():
+            if old is None or target < old:
+                qs = siblings.filter(**{name + '__gte': target})
+                if old is not None:
+                    qs = qs.filter(**{name + '__lt': old})
+                qs.update(**dict(touch, **{name: models.F(name) + 1}))
+            else:
+                qs = siblings.filter(**{name + '__gt': old,
+                                        name + '__lte': target})
+                qs.update(**dict(touch, **{name: models.F(name) - 1}))
+            model.objects.filter(pk=elem.pk).update(
+                **dict(touch, **{name: target}))
+            if old is None:
+                qs = siblings.filter(**{name + '__gt': target})
+            else:
+                lo, hi = sorted([target, old])
+                qs = siblings.filter(
+                    **{name + '__gte': lo, name + '__lte': hi})
+            changed = [[elem.pk, target]] + [
+                list(t) for t in qs.values_list('pk', name)]
+            if settings.SITE.plugins.extjs.live_grids:
+                from .live import push_changes
+                push_changes(model, [pk for pk, seqno in changed])
+        bump_generation(model)
+        return json_response(dict(success=True, changed=changed))
+
+
+BATCHABLE_VIEWS = (ApiList, ApiElement, Restful, Choices,
+                   ActionParamChoices)
+"""The views which can be called by a sub-request of :class:`ApiBatch`."""
+
+
+def run_subrequest(request, spec):
+    """Run the sub-request described by the given `spec` (a dict with the
+    keys `url` and `params`) of the given batch request and return a
+    dict with the `status` and the `text` of its response.
+
+    The sub-request is a copy of the batch request (same user, session
+    and authentication), but a GET to another URL of the API.  Its
+    status is the same as if that URL had been requested directly.
+
+    """
+    if not isinstance(spec, dict):
+        return dict(status=400, text="")
+    url = spec.get('url', '')
+    parts = urlsplit(url)
+    path = parts.path
+    prefix = get_script_prefix()
+    if path.startswith(prefix):
+        path = '/' + path[len(prefix):]
+    try:
+        match = resolve(path)
+    except http.Http404:
+        return dict(status=404, text="")
+    if getattr(match.func, 'view_class', None) not in BATCHABLE_VIEWS:
+        return dict(status=403, text="")
+    GET = http.QueryDict(parts.query, mutable=True)
+    for k, v in (spec.get('params') or {}).items():
+        if isinstance(v, list):
+            GET.setlist(k, [str(x) for x in v])
+        else:
+            GET[k] = str(v)
+    sub = copy.copy(request)
+    sub.method = 'GET'
+    sub.GET = GET
+    sub.POST = http.QueryDict('')
+    sub.path = sub.path_info = path
+    sub.META = dict(request.META)
+    sub.META.update(REQUEST_METHOD='GET', QUERY_STRING=GET.urlencode())
+    sub.META.pop('HTTP_IF_NONE_MATCH', None)
+    try:
+        response = match.func(sub, *match.args, **match.kwargs)
+    except http.Http404 as e:
+        return dict(status=404, text=str(e))
+    except PermissionDenied as e:
+        return dict(status=403, text=str(e))
+    except SuspiciousOperation as e:
+        return dict(status=400, text=str(e))
+    except Exception as e:
+        logger.exception("Batched request to %s failed", url)
+        return dict(status=500, text=str(e))
+    if response.streaming:
+        content = b''.join(response.streaming_content)
+    else:
+        content = response.content
+    return dict(status=response.status_code,
+                text=content.decode(response.charset or 'utf-8'))
+
+
+class ApiBatch(View):
+    """Run several GET requests to the API in a single round trip.
+
+    The client POSTs a parameter `requests` containing a JSON list of
+    sub-requests, each of them a dict with the `url` (e.g.
+    ``/api/contacts/Persons/123``) and the `params` of a request to
+    one of the :data:`BATCHABLE_VIEWS`.  The response contains a list
+    `responses` with the `status` and the `text` of the response to
+    each sub-request, in the same order.
+
+    Sub-requests are run one after the other or, if
+    :attr:`batch_workers <lino_extjs6.extjs.Plugin.batch_workers>` is
+    set, in parallel threads.
+
+    """
+    def post(self, request):
+        try:
+            specs = json.loads(request.POST.get('requests', '[]'))
+        except ValueError:
+            return http.HttpResponseBadRequest("Invalid requests")
+        if not isinstance(specs, list) or \
+           len(specs) > settings.SITE.plugins.extjs.max_batch_size:
+            return http.HttpResponseBadRequest("Invalid requests")
+        workers = settings.SITE.plugins.extjs.batch_workers
+        if workers and workers > 1 and len(specs) > 1:
+            language = translation.get_language()
+
+            def run(spec):
+                translation.activate(language)
+                try:
+                    return run_subrequest(request, spec)
+                finally:
+                    connections.close_all()
+
+            pool = ThreadPool(min(workers, len(specs)))
+            try:
+                responses = pool.map(run, specs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            responses = [run_subrequest(request, spec) for spec in specs]
+        return json_response(dict(success=True, responses=responses))
+
+
 class GridConfig(View):
     def put(self, request, app_label=None, actor=None):
         rpt = requested_actor(app_label, actor)
@@ -508,5 +1153,7 @@ class GridConfig(View):
                 table=rpt, error=e)
             return settings.SITE.kernel.error(None, msg, alert=True)
         # ~ logger.info(msg)
-        settings.SITE.kernel.extjs_renderer.build_site_cache(True)
+        # only the code generated for this actor depends on its grid
+        # configs
+        settings.SITE.kernel.extjs_renderer.rebuild_actor_js(rpt)
         return settings.SITE.kernel.success(msg)
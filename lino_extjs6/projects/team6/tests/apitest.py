@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""The base class of the tests which send requests to the API of the
+team6 demo project.
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+
+from django.conf import settings
+from django.utils.http import urlencode
+
+from lino.utils.djangotest import RemoteAuthTestCase
+from lino.api import rt
+
+
+class ApiTestCase(RemoteAuthTestCase):
+    """A test case with a site administrator `robin`.
+
+    The options of the :mod:`lino_extjs6.extjs` plugin which are given
+    in :attr:`plugin_options` are set for every test.
+
+    """
+    maxDiff = None
+    plugin_options = dict()
+
+    def setUp(self):
+        super(ApiTestCase, self).setUp()
+        self.plugin = settings.SITE.plugins.extjs
+        self.old_options = dict([
+            (k, getattr(self.plugin, k)) for k in self.plugin_options])
+        for k, v in self.plugin_options.items():
+            setattr(self.plugin, k, v)
+        User = rt.models.users.User
+        self.robin = User.objects.create(
+            username='robin', user_type=rt.models.users.UserTypes.admin,
+            language='en')
+
+    def tearDown(self):
+        for k, v in self.old_options.items():
+            setattr(self.plugin, k, v)
+        super(ApiTestCase, self).tearDown()
+
+    def get_json(self, url, data=None, **kw):
+        """Send a GET as robin and return the decoded JSON response."""
+        res = self.client.get(url, data or {}, REMOTE_USER='robin', **kw)
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.content.decode('utf-8'))
+
+    def send_form(self, method, url, data, username='robin'):
+        """Send a request with the given form `data` as body and return the
+        response.
+
+        """
+        return getattr(self.client, method)(
+            url, urlencode(data, doseq=True),
+            content_type='application/x-www-form-urlencoded',
+            REMOTE_USER=username)
+
+    def get_pks(self, actor, rows):
+        """Return the primary keys of the given rows of a JSON response
+        of the given actor, without the phantom row.
+
+        """
+        i = actor.get_handle().store.pk_index
+        return [row[i] for row in rows if row[i] is not None]
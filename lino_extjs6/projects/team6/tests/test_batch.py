@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Tests for :class:`lino_extjs6.extjs.views.ApiBatch`.
+
+You can run only these tests by issuing::
+
+  $ cd lino_extjs6/projects/team6
+  $ python manage.py test tests.test_batch
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+
+from lino.api import rt
+
+from .apitest import ApiTestCase
+
+
+class BatchTests(ApiTestCase):
+
+    def batch(self, specs, username='robin'):
+        res = self.send_form(
+            'post', '/api/batch', dict(requests=json.dumps(specs)),
+            username=username)
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.content.decode('utf-8'))['responses']
+
+    def test_statuses(self):
+        responses = self.batch([
+            dict(url='/api/users/AllUsers', params=dict(fmt='json')),
+            dict(url='/api/users/NoSuchTable', params=dict(fmt='json')),
+            dict(url='/grid_config/users/AllUsers'),
+            'foo'])
+        self.assertEqual([r['status'] for r in responses],
+                         [200, 404, 403, 400])
+        d = json.loads(responses[0]['text'])
+        self.assertEqual(
+            self.get_pks(rt.models.users.AllUsers, d['rows']),
+            [self.robin.pk])
+
+    def test_permission_denied(self):
+        """A sub-request which the user may not run gets the same status
+        as if it had been sent directly.
+
+        """
+        rt.models.users.User.objects.create(
+            username='guest', user_type=rt.models.users.UserTypes.anonymous)
+        spec = dict(url='/api/users/AllUsers', params=dict(fmt='json'))
+        res = self.client.get(
+            spec['url'], spec['params'], REMOTE_USER='guest')
+        responses = self.batch([spec], username='guest')
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(responses[0]['status'], 403)
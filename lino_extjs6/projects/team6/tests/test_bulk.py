@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Tests for saving and deleting several rows in a single request.
+
+You can run only these tests by issuing::
+
+  $ cd lino_extjs6/projects/team6
+  $ python manage.py test tests.test_bulk
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+
+from lino.api import rt
+
+from .apitest import ApiTestCase
+
+URL = '/restful/users/AllUsers'
+
+
+class BulkTests(ApiTestCase):
+
+    def test_bulk_create(self):
+        User = rt.models.users.User
+        rows = [dict(username='anna'), dict(username='bert')]
+        res = self.send_form('post', URL, dict(rows=json.dumps(rows)))
+        self.assertEqual(res.status_code, 200)
+        d = json.loads(res.content.decode('utf-8'))
+        self.assertTrue(d['success'])
+        self.assertEqual(len(d['rows']), 2)
+        self.assertEqual(
+            User.objects.filter(username__in=['anna', 'bert']).count(), 2)
+
+    def test_bulk_update(self):
+        User = rt.models.users.User
+        anna = User.objects.create(username='anna')
+        bert = User.objects.create(username='bert')
+        rows = [dict(id=anna.pk, first_name='Anna'),
+                dict(id=bert.pk, first_name='Bert')]
+        res = self.send_form('put', URL, dict(rows=json.dumps(rows)))
+        self.assertEqual(res.status_code, 200)
+        d = json.loads(res.content.decode('utf-8'))
+        self.assertTrue(d['success'])
+        self.assertEqual(User.objects.get(pk=anna.pk).first_name, 'Anna')
+        self.assertEqual(User.objects.get(pk=bert.pk).first_name, 'Bert')
+
+    def test_all_or_nothing(self):
+        """Both rows are valid on their own, but saving the second one
+        violates the unique username, so nothing is saved.
+
+        """
+        User = rt.models.users.User
+        anna = User.objects.create(username='anna')
+        bert = User.objects.create(username='bert')
+        rows = [dict(id=anna.pk, username='same'),
+                dict(id=bert.pk, username='same')]
+        res = self.send_form('put', URL, dict(rows=json.dumps(rows)))
+        self.assertEqual(res.status_code, 200)
+        d = json.loads(res.content.decode('utf-8'))
+        self.assertFalse(d['success'])
+        self.assertEqual([e['index'] for e in d['errors']], [1])
+        self.assertEqual(User.objects.get(pk=anna.pk).username, 'anna')
+        self.assertEqual(User.objects.get(pk=bert.pk).username, 'bert')
+
+    def test_bulk_delete(self):
+        User = rt.models.users.User
+        anna = User.objects.create(username='anna')
+        bert = User.objects.create(username='bert')
+        carl = User.objects.create(username='carl')
+        res = self.send_form(
+            'delete', '/api/users/AllUsers',
+            dict(sr=[anna.pk, bert.pk, 987654]))
+        self.assertEqual(res.status_code, 200)
+        d = json.loads(res.content.decode('utf-8'))
+        self.assertFalse(d['success'])
+        self.assertEqual(d['deleted'], [str(anna.pk), str(bert.pk)])
+        self.assertEqual([f['pk'] for f in d['failures']], ['987654'])
+        self.assertEqual(
+            list(User.objects.filter(
+                pk__in=[anna.pk, bert.pk, carl.pk]).values_list(
+                    'pk', flat=True)), [carl.pk])
+
+    def test_bulk_delete_forbidden(self):
+        User = rt.models.users.User
+        User.objects.create(
+            username='guest', user_type=rt.models.users.UserTypes.anonymous)
+        anna = User.objects.create(username='anna')
+        res = self.send_form(
+            'delete', '/api/users/AllUsers', dict(sr=[anna.pk]),
+            username='guest')
+        self.assertEqual(res.status_code, 403)
+        self.assertTrue(User.objects.filter(pk=anna.pk).exists())
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Tests for :mod:`lino_extjs6.extjs.bundles`.
+
+You can run only these tests by issuing::
+
+  $ cd lino_extjs6/projects/team6
+  $ python manage.py test tests.test_bundles
+
+"""
+
+from __future__ import unicode_literals
+
+import os
+import json
+import shutil
+import tempfile
+
+from lino.utils.djangotest import RemoteAuthTestCase
+
+from lino_extjs6.extjs.bundles import (
+    vlq_encode, minify_js, make_source_map, remove_variants)
+
+CODE = """// comment
+var a = 1;
+
+  /* block
+     comment */ var b = 2;
+  function f() {
+      return "a\\
+  b";
+  }
+/* one */
+"""
+
+
+class BundlesTests(RemoteAuthTestCase):
+    maxDiff = None
+
+    def test_vlq_encode(self):
+        self.assertEqual(
+            [vlq_encode(v) for v in (0, 1, -1, 15, 16, -16, 1000)],
+            ['A', 'C', 'D', 'e', 'gB', 'hB', 'w+B'])
+
+    def test_minify_js(self):
+        minified, origins = minify_js(CODE)
+        # the continuation of a string keeps its leading whitespace
+        self.assertEqual(minified, (
+            'var a = 1;\n'
+            'var b = 2;\n'
+            'function f() {\n'
+            'return "a\\\n'
+            '  b";\n'
+            '}\n'))
+        self.assertEqual(
+            origins, [(1, 0), (4, 16), (5, 2), (6, 6), (7, 0), (8, 2)])
+        lines = CODE.splitlines()
+        for text, (line, col) in zip(minified.splitlines(), origins):
+            self.assertTrue(lines[line][col:].startswith(text))
+
+    def test_make_source_map(self):
+        minified, origins = minify_js(CODE)
+        sm = json.loads(make_source_map('x.min.js', 'x.js', origins))
+        self.assertEqual(sm['version'], 3)
+        self.assertEqual(sm['file'], 'x.min.js')
+        self.assertEqual(sm['sources'], ['x.js'])
+        self.assertEqual(
+            sm['mappings'], 'AACA;AAGgB;AACd;AACI;AACN;AACE')
+
+    def test_remove_variants(self):
+        dn = tempfile.mkdtemp()
+        try:
+            for name in ('a.js', 'a.js.min', 'a.js.gz', 'b.js'):
+                with open(os.path.join(dn, name), 'w') as f:
+                    f.write('x')
+            remove_variants(os.path.join(dn, 'a.js'))
+            self.assertEqual(os.listdir(dn), ['b.js'])
+        finally:
+            shutil.rmtree(dn)
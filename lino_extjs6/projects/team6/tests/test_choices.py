@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Tests for :mod:`lino_extjs6.extjs.choices`.
+
+You can run only these tests by issuing::
+
+  $ cd lino_extjs6/projects/team6
+  $ python manage.py test tests.test_choices
+
+"""
+
+from __future__ import unicode_literals
+
+from lino.core import constants
+from lino.utils.djangotest import RemoteAuthTestCase
+from lino.api import rt
+
+from lino_extjs6.extjs.choices import ChoicesIndex, get_text_tables
+
+
+def choice(value, text):
+    row = dict()
+    row[constants.CHOICES_VALUE_FIELD] = value
+    row[constants.CHOICES_TEXT_FIELD] = text
+    return row
+
+
+class ChoicesTests(RemoteAuthTestCase):
+    maxDiff = None
+
+    def test_search(self):
+        rows = [choice(1, "Eupen"), choice(2, "Kettenis"),
+                choice(3, "Raeren"), choice(4, "Eynatten")]
+        index = ChoicesIndex(rows)
+
+        def values(text):
+            return [r[constants.CHOICES_VALUE_FIELD]
+                    for r in index.search(text)]
+
+        self.assertEqual(values(''), [1, 2, 3, 4])
+        self.assertEqual(values(None), [1, 2, 3, 4])
+        self.assertEqual(values('e'), [1, 2, 3, 4])
+        self.assertEqual(values('EN'), [1, 2, 3, 4])
+        self.assertEqual(values('ten'), [2, 4])
+        self.assertEqual(values('tten'), [2, 4])
+        self.assertEqual(values('eup'), [1])
+        self.assertEqual(values('aer'), [3])
+        self.assertEqual(values('xyz'), [])
+        self.assertEqual(values('rene'), [])
+
+    def test_empty_index(self):
+        index = ChoicesIndex([])
+        self.assertEqual(index.search(''), [])
+        self.assertEqual(index.search('foo'), [])
+
+    def test_text_tables(self):
+        User = rt.models.users.User
+        Partner = rt.models.contacts.Partner
+        tables = get_text_tables(User)
+        self.assertIn(Partner._meta.db_table, tables)
+        self.assertEqual(get_text_tables(User, 0), set())
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Tests for :func:`lino_extjs6.extjs.views.rows2columns`.
+
+You can run only these tests by issuing::
+
+  $ cd lino_extjs6/projects/team6
+  $ python manage.py test tests.test_columnar
+
+"""
+
+from __future__ import unicode_literals
+
+from lino.utils.djangotest import RemoteAuthTestCase
+
+from lino_extjs6.extjs.views import rows2columns
+
+
+def decode(columns):
+    """Convert the given columns back into rows."""
+    cols = []
+    for col in columns:
+        if isinstance(col, dict):
+            col = [col['d'][i] for i in col['i']]
+        cols.append(col)
+    return [list(row) for row in zip(*cols)]
+
+
+class ColumnarTests(RemoteAuthTestCase):
+    maxDiff = None
+
+    def test_empty(self):
+        self.assertEqual(rows2columns([]), [])
+
+    def test_encoding(self):
+        rows = [[1, 'a', None], [2, 'a', None], [3, 'b', None],
+                [4, 'a', None]]
+        cols = rows2columns(rows)
+        self.assertEqual(cols[0], [1, 2, 3, 4])
+        self.assertEqual(cols[1], dict(d=['a', 'b'], i=[0, 0, 1, 0]))
+        self.assertEqual(cols[2], dict(d=[None], i=[0, 0, 0, 0]))
+        self.assertEqual(decode(cols), rows)
+
+    def test_equal_values_of_different_types(self):
+        rows = [[True], [1], [1.0], [True], [1], [1.0], [True], [1]]
+        cols = rows2columns(rows)
+        self.assertEqual(cols[0]['i'], [0, 1, 2, 0, 1, 2, 0, 1])
+        decoded = decode(cols)
+        self.assertEqual(
+            [type(row[0]) for row in decoded],
+            [type(row[0]) for row in rows])
+
+    def test_unhashable_values(self):
+        rows = [[[1, 2], dict(a=1)], [[1, 2], dict(a=1)],
+                [[2, 1], dict(a=1)], [[1, 2], dict(a=2)]]
+        cols = rows2columns(rows)
+        self.assertEqual(cols[0], dict(d=[[1, 2], [2, 1]], i=[0, 0, 1, 0]))
+        self.assertEqual(
+            cols[1], dict(d=[dict(a=1), dict(a=2)], i=[0, 0, 0, 1]))
+        self.assertEqual(decode(cols), rows)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Tests for :mod:`lino_extjs6.extjs.delta`.
+
+You can run only these tests by issuing::
+
+  $ cd lino_extjs6/projects/team6
+  $ python manage.py test tests.test_delta
+
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+
+from django.utils import timezone
+
+from lino.api import rt
+
+from lino_extjs6.extjs import delta
+
+from .apitest import ApiTestCase
+
+URL = '/api/users/AllUsers'
+
+
+class DeltaTests(ApiTestCase):
+    plugin_options = dict(delta_refresh=True)
+
+    def test_token(self):
+        before = timezone.now() - delta.TOKEN_MARGIN \
+            - datetime.timedelta(seconds=delta.TOKEN_STEP)
+        t = delta.parse_token(delta.get_token())
+        after = timezone.now() - delta.TOKEN_MARGIN
+        self.assertTrue(before <= t <= after)
+        self.assertEqual(t.microsecond, 0)
+        self.assertEqual(t.second % delta.TOKEN_STEP, 0)
+        self.assertIsNone(delta.parse_token('foo'))
+        self.assertIsNone(delta.parse_token(None))
+
+    def test_etag(self):
+        """The since_token doesn't prevent a 304 response when nothing
+        changed.
+
+        """
+        for i in range(2):  # unless a token window ended in between
+            token = delta.get_token()
+            res = self.client.get(URL, dict(fmt='json'), REMOTE_USER='robin')
+            self.assertEqual(res.status_code, 200)
+            res = self.client.get(
+                URL, dict(fmt='json'), REMOTE_USER='robin',
+                HTTP_IF_NONE_MATCH=res['ETag'])
+            if delta.get_token() == token:
+                break
+        self.assertEqual(res.status_code, 304)
+
+    def test_delta(self):
+        User = rt.models.users.User
+        actor = rt.models.users.AllUsers
+        users = [User.objects.create(username="delta%d" % i)
+                 for i in range(3)]
+        past = timezone.now() - datetime.timedelta(days=1)
+        User.objects.update(modified=past)
+
+        params = dict(fmt='json', query='delta')
+        d = self.get_json(URL, params)
+        self.assertEqual(
+            sorted(self.get_pks(actor, d['rows'])),
+            sorted([u.pk for u in users]))
+        params.update(since=d['since_token'])
+
+        d = self.get_json(URL, params)
+        self.assertTrue(d['delta'])
+        self.assertEqual((d['rows'], d['deleted']), ([], []))
+
+        # one user is modified, another no longer matches the query
+        future = timezone.now() + datetime.timedelta(days=1)
+        User.objects.filter(pk=users[0].pk).update(
+            first_name="Anna", modified=future)
+        User.objects.filter(pk=users[1].pk).update(
+            username="gone", modified=future)
+        d = self.get_json(URL, params)
+        self.assertTrue(d['delta'])
+        self.assertEqual(self.get_pks(actor, d['rows']), [users[0].pk])
+        self.assertEqual(d['deleted'], [users[1].pk])
+
+        # more changes than the limit ask for a reload
+        params.update(limit=1)
+        d = self.get_json(URL, params)
+        self.assertFalse(d['delta'])
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Tests for :mod:`lino_extjs6.extjs.keyset`.
+
+You can run only these tests by issuing::
+
+  $ cd lino_extjs6/projects/team6
+  $ python manage.py test tests.test_keyset
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+import datetime
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+from lino.api import rt
+
+from lino_extjs6.extjs import keyset
+
+from .apitest import ApiTestCase
+
+
+class KeysetTests(ApiTestCase):
+    plugin_options = dict(keyset_pagination=True)
+
+    def test_get_keyset(self):
+        User = rt.models.users.User
+        ks = keyset.get_keyset(User.objects.order_by('-modified'))
+        self.assertEqual(
+            [(name, desc) for name, fld, desc in ks],
+            [('modified', True), ('pk', False)])
+        ks = keyset.get_keyset(User.objects.order_by('pk', 'username'))
+        self.assertEqual([name for name, fld, desc in ks], ['pk'])
+        self.assertIsNone(keyset.get_keyset(
+            User.objects.order_by('partner__name')))
+
+    def test_keyset_filter(self):
+        User = rt.models.users.User
+        pks = [User.objects.create(username="filter%d" % i).pk
+               for i in range(3)]
+        for pk, name in zip(pks, ['b', 'a', 'b']):
+            User.objects.filter(pk=pk).update(first_name=name)
+        qs = User.objects.filter(pk__in=pks).order_by('-first_name', 'pk')
+        ks = keyset.get_keyset(qs)
+        self.assertEqual(
+            [(name, desc) for name, fld, desc in ks],
+            [('first_name', True), ('pk', False)])
+        ordered = list(qs.values_list('pk', flat=True))
+        self.assertEqual(ordered, [pks[0], pks[2], pks[1]])
+        for i, pk in enumerate(ordered):
+            values = [{pks[1]: 'a'}.get(pk, 'b'), pk]
+            after = qs.filter(keyset.keyset_filter(ks, values))
+            self.assertEqual(
+                list(after.values_list('pk', flat=True)), ordered[i + 1:])
+
+    def test_encode_value(self):
+        fld = models.DateTimeField()
+        t = datetime.datetime(2018, 1, 1, 12, 0, 0, 123456)
+        self.assertEqual(keyset.encode_value(t),
+                         '2018-01-01T12:00:00.123456')
+        self.assertEqual(fld.to_python(keyset.encode_value(t)), t)
+        fld = models.TimeField()
+        t = datetime.time(12, 0, 0, 456)
+        self.assertEqual(fld.to_python(keyset.encode_value(t)), t)
+
+    def test_datetime_ordering(self):
+        """Rows whose timestamps differ by less than a millisecond are
+        neither repeated nor skipped at page boundaries.
+
+        """
+        User = rt.models.users.User
+        base = datetime.datetime(2018, 1, 1, 12, 0, 0)
+        if settings.USE_TZ:
+            base = timezone.make_aware(base, timezone.utc)
+        for i in range(7):
+            u = User.objects.create(username="keyset%d" % i)
+            User.objects.filter(pk=u.pk).update(
+                modified=base + datetime.timedelta(microseconds=i * 100))
+        expected = list(User.objects.order_by(
+            '-modified', 'pk').values_list('pk', flat=True))
+
+        actor = rt.models.users.AllUsers
+        params = dict(fmt='json', limit=2, sort=json.dumps([
+            dict(property='modified', direction='DESC')]))
+        seen = []
+        while True:
+            d = self.get_json('/api/users/AllUsers', params)
+            seen += self.get_pks(actor, d['rows'])
+            next_cursor = d.get('next_cursor')
+            if next_cursor is None:
+                break
+            params.update(start=next_cursor['start'],
+                          cursor=next_cursor['value'])
+        self.assertEqual(seen, expected)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Tests for :class:`lino_extjs6.extjs.views.Resequence`.
+
+You can run only these tests by issuing::
+
+  $ cd lino_extjs6/projects/team6
+  $ python manage.py test tests.test_resequence
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+
+from django.conf import settings
+
+from lino.api import rt
+
+from .apitest import ApiTestCase
+
+
+class ResequenceTests(ApiTestCase):
+
+    def setUp(self):
+        super(ResequenceTests, self).setUp()
+        if not settings.SITE.is_installed('dashboard'):
+            self.skipTest("dashboard is not installed")
+        Widget = rt.models.dashboard.Widget
+        self.actor = Widget.get_default_table()
+        self.old_field = self.actor.drag_drop_sequenced_field
+        self.actor.drag_drop_sequenced_field = 'seqno'
+        self.url = '/resequence/%s/%s' % (
+            self.actor.app_label, self.actor.__name__)
+        self.widgets = [
+            Widget.objects.create(
+                user=self.robin, item_name="widget%d" % i, seqno=i)
+            for i in range(1, 5)]
+
+    def tearDown(self):
+        if hasattr(self, 'old_field'):
+            self.actor.drag_drop_sequenced_field = self.old_field
+        super(ResequenceTests, self).tearDown()
+
+    def resequence(self, elem, target):
+        res = self.send_form(
+            'post', self.url,
+            dict(pk=elem.pk, target=target))
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.content.decode('utf-8'))
+
+    def get_order(self):
+        return list(rt.models.dashboard.Widget.objects.filter(
+            user=self.robin).order_by('seqno').values_list(
+                'item_name', flat=True))
+
+    def test_move_up(self):
+        w1, w2, w3, w4 = self.widgets
+        d = self.resequence(w4, 2)
+        self.assertTrue(d['success'])
+        self.assertEqual(
+            sorted(d['changed']),
+            sorted([[w4.pk, 2], [w2.pk, 3], [w3.pk, 4]]))
+        self.assertEqual(
+            self.get_order(),
+            ['widget1', 'widget4', 'widget2', 'widget3'])
+
+    def test_move_down(self):
+        w1, w2, w3, w4 = self.widgets
+        d = self.resequence(w1, 3)
+        self.assertEqual(
+            sorted(d['changed']),
+            sorted([[w1.pk, 3], [w2.pk, 1], [w3.pk, 2]]))
+        self.assertEqual(
+            self.get_order(),
+            ['widget2', 'widget3', 'widget1', 'widget4'])
+
+    def test_invalid_target(self):
+        res = self.send_form(
+            'post', self.url,
+            dict(pk=self.widgets[0].pk, target='x'))
+        self.assertEqual(res.status_code, 400)